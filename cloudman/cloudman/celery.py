@@ -5,8 +5,12 @@ from __future__ import absolute_import
 import os
 
 import celery
+from celery.signals import task_postrun
+from celery.signals import task_prerun
 from django.conf import settings  # noqa
 
+from clusterman.clients import command_cache
+
 import logging
 log = logging.getLogger(__name__)
 
@@ -29,3 +33,21 @@ app = Celery('proj')
 # app.config_from_object('django.conf:settings')
 app.config_from_envvar('CELERY_CONFIG_MODULE')
 app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
+
+
+# Cache read-only kubectl and helm command output for the duration of each
+# task, as is done for each API request.
+_command_cache_tokens = {}
+
+
+@task_prerun.connect
+def enable_command_cache(task_id=None, **kwargs):
+    _command_cache_tokens[task_id] = command_cache.active_cache.set(
+        command_cache.CommandCache())
+
+
+@task_postrun.connect
+def disable_command_cache(task_id=None, **kwargs):
+    token = _command_cache_tokens.pop(task_id, None)
+    if token:
+        command_cache.active_cache.reset(token)
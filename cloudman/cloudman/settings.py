@@ -29,7 +29,9 @@ AUTHENTICATION_BACKENDS = [
 ]
 
 MIDDLEWARE += [
-    'mozilla_django_oidc.middleware.SessionRefresh'
+    'mozilla_django_oidc.middleware.SessionRefresh',
+    'clusterman.middleware.CommandCacheMiddleware',
+    'clusterman.middleware.CommandSummaryMiddleware'
 ]
 
 REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES'] += ('mozilla_django_oidc.contrib.drf.OIDCAuthentication',)
@@ -100,6 +102,36 @@ if os.path.isfile(CM_GLOBAL_CONTEXT_PATH) and os.access(CM_GLOBAL_CONTEXT_PATH,
 else:
     CM_GLOBAL_CONTEXT = {}
 
+# Maximum number of helm or kubectl commands that may be run concurrently
+# when fanning out over many releases or nodes
+HELMSMAN_MAX_CONCURRENCY = int(os.environ.get('HELMSMAN_MAX_CONCURRENCY', 8))
+
+# Read releases directly from helm's storage secrets with a single kubectl
+# call, instead of running helm for each release. Requires permission to
+# list secrets in all namespaces that contain releases.
+HELMSMAN_USE_HELM_STORAGE = os.environ.get(
+    'HELMSMAN_USE_HELM_STORAGE', '').lower() in ('1', 'true', 'yes')
+
+# Seconds after which a helm repository's index is considered stale and is
+# updated before installing a chart from it
+HELMSMAN_REPO_MAX_AGE = int(os.environ.get('HELMSMAN_REPO_MAX_AGE', 300))
+
+# Maximum number of compiled install templates kept in memory per process
+HELMSMAN_TEMPLATE_CACHE_SIZE = int(
+    os.environ.get('HELMSMAN_TEMPLATE_CACHE_SIZE', 256))
+
+# Directory in which compiled install templates are cached, so that they
+# are not compiled again by new worker processes. The directory must be
+# private to the user CloudMan runs as. Defaults to a per-user directory
+# under the temp dir. Set to an empty value to disable.
+HELMSMAN_TEMPLATE_BYTECODE_CACHE_DIR = os.environ.get(
+    'HELMSMAN_TEMPLATE_BYTECODE_CACHE_DIR')
+
+# Maximum number of nodes that are drained concurrently when several nodes
+# are removed at once
+CLUSTERMAN_MAX_PARALLEL_DRAINS = int(
+    os.environ.get('CLUSTERMAN_MAX_PARALLEL_DRAINS', 5))
+
 # Allow settings to be overridden in a cloudman/settings_local.py
 try:
     from cloudman.settings_local import *  # noqa
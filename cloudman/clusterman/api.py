@@ -135,8 +135,8 @@ class CMClusterService(CMService):
 
     def delete(self, cluster):
         self.check_permissions('clusters.delete_cluster', cluster)
-        for node in cluster.nodes.list():
-            node.delete()
+        # drain the cluster's nodes in parallel rather than one at a time
+        cluster.nodes.delete_many(cluster.nodes.list())
         cluster.db_model.delete()
 
 
@@ -199,6 +199,20 @@ class CMClusterNodeService(CMService):
         else:
             print(f"Unexpected, asked to delete a null node!")
 
+    def delete_many(self, nodes):
+        """
+        Deletes several nodes at once. The nodes are cordoned together and
+        drained in parallel, with each node's VM deleted as soon as the node
+        has been drained.
+        """
+        nodes = [node for node in nodes if node]
+        for node in nodes:
+            self.check_permissions('clusternodes.delete_clusternode', node)
+        if nodes:
+            print(f"Deleting nodes: {[node.name for node in nodes]}")
+            return tasks.delete_nodes.delay(
+                self.cluster.id, [node.id for node in nodes])
+
 
 class CMClusterAutoScalerService(CMService):
 
@@ -0,0 +1,180 @@
+"""
+A short lived cache for the output of read-only kubectl and helm commands.
+"""
+import contextlib
+import contextvars
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TTL = float(os.environ.get('CM_COMMAND_CACHE_TTL', 2))
+
+# Normalises the resource names accepted by kubectl into a single kind
+KUBE_KINDS = {
+    'namespace': 'namespaces', 'namespaces': 'namespaces', 'ns': 'namespaces',
+    'node': 'nodes', 'nodes': 'nodes', 'no': 'nodes',
+    'pod': 'pods', 'pods': 'pods', 'po': 'pods',
+    'secret': 'secrets', 'secrets': 'secrets',
+}
+KUBE_READS = {'get'}
+KUBE_WRITES = {'create', 'delete', 'label', 'annotate', 'apply', 'patch',
+               'replace'}
+# Node operations and the pod kinds that they affect
+KUBE_NODE_WRITES = {'cordon': {'nodes'}, 'uncordon': {'nodes'},
+                    'taint': {'nodes'}, 'drain': {'nodes', 'pods'}}
+HELM_READS = {'list': {'releases'}, 'history': {'releases'},
+              'status': {'releases'}, 'get': {'releases'},
+              'search': {'repo_charts'}}
+# Helm stores releases as secrets, so release changes also affect secrets
+HELM_WRITES = {'install': {'releases', 'secrets'},
+               'upgrade': {'releases', 'secrets'},
+               'rollback': {'releases', 'secrets'},
+               'delete': {'releases', 'secrets'},
+               'uninstall': {'releases', 'secrets'}}
+HELM_REPO_READS = {'list': {'repositories'}}
+HELM_REPO_WRITES = {'add': {'repositories', 'repo_charts'},
+                    'remove': {'repositories', 'repo_charts'},
+                    'update': {'repo_charts'}}
+ALL_KINDS = None
+
+# Totals across all caches in this process, for tuning the cache
+stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+_stats_lock = threading.Lock()
+
+
+def classify(command):
+    """
+    Returns a tuple of (is_read, kinds) for a command. Reads are cacheable
+    and are invalidated when any of the kinds change. For writes, kinds are
+    the resource kinds the command modifies, or ALL_KINDS if it could affect
+    anything. Returns (False, set()) for commands that neither read nor
+    modify a known kind.
+    """
+    if not isinstance(command, (list, tuple)) or len(command) < 2:
+        return False, set()
+    prog, args = os.path.basename(command[0]), list(command[1:])
+    positional = [arg for arg in args if not arg.startswith("-")]
+    if not positional:
+        return False, set()
+    verb = positional[0]
+    target = positional[1] if len(positional) > 1 else None
+    if prog == "kubectl":
+        kind = KUBE_KINDS.get(target.split("/")[0] if target else None)
+        if verb in KUBE_READS and kind:
+            if "--watch" in args or "-w" in args:
+                return False, set()
+            return True, {kind}
+        if verb in KUBE_WRITES:
+            # Deleting a namespace deletes everything in it
+            if kind == 'namespaces' and verb == 'delete':
+                return False, ALL_KINDS
+            return False, {kind} if kind else ALL_KINDS
+        if verb in KUBE_NODE_WRITES:
+            return False, KUBE_NODE_WRITES[verb]
+    elif prog == "helm":
+        if verb == "repo":
+            if target in HELM_REPO_READS:
+                return True, HELM_REPO_READS[target]
+            return False, HELM_REPO_WRITES.get(target, set())
+        if verb in HELM_READS:
+            return True, HELM_READS[verb]
+        if verb in HELM_WRITES:
+            return False, HELM_WRITES[verb]
+    return False, set()
+
+
+def _kube_context():
+    return (os.environ.get('KUBECONFIG'), os.environ.get('HELM_KUBECONTEXT'),
+            os.environ.get('HELM_NAMESPACE'))
+
+
+def _count(stat, value=1):
+    with _stats_lock:
+        stats[stat] += value
+
+
+class CommandCache(object):
+    """
+    Caches the output of read-only commands for ttl seconds, keyed by the
+    command line and the kube context it runs against. Commands that modify
+    resources invalidate all cached output for the kinds they affect.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _key(self, command):
+        return tuple(command), _kube_context()
+
+    def lookup(self, command):
+        """
+        Returns the cached output of a command, or None if the command must be
+        run. Commands that modify resources invalidate the affected kinds.
+        """
+        is_read, kinds = classify(command)
+        if not is_read:
+            if kinds or kinds is ALL_KINDS:
+                self.invalidate(kinds)
+            return None
+        with self._lock:
+            expiry, _, output = self._entries.get(
+                self._key(command), (0, None, None))
+            if expiry > time.monotonic():
+                self.hits += 1
+                _count('hits')
+                return output
+            self.misses += 1
+        _count('misses')
+        return None
+
+    def store(self, command, output):
+        is_read, kinds = classify(command)
+        if is_read and self.ttl > 0:
+            with self._lock:
+                self._entries[self._key(command)] = (
+                    time.monotonic() + self.ttl, kinds, output)
+
+    def invalidate(self, kinds=ALL_KINDS):
+        """
+        Removes cached output for commands reading any of the given kinds,
+        or all cached output if kinds is ALL_KINDS.
+        """
+        with self._lock:
+            stale = [key for key, (_, entry_kinds, _) in self._entries.items()
+                     if kinds is ALL_KINDS or entry_kinds & kinds]
+            for key in stale:
+                del self._entries[key]
+        _count('invalidations', len(stale))
+
+
+# The cache used by run_command, if any. Caching is scoped, for example to
+# a single API request or Celery task, through the cached_commands context
+# manager.
+active_cache = contextvars.ContextVar('active_command_cache', default=None)
+
+
+@contextlib.contextmanager
+def cached_commands(ttl=DEFAULT_TTL):
+    """
+    Context manager which caches the output of read-only commands run
+    within it.
+    Usage:
+        with cached_commands():
+            KubeClient().namespaces.list()
+            KubeClient().namespaces.list()  # served from the cache
+    """
+    cache = CommandCache(ttl=ttl)
+    token = active_cache.set(cache)
+    try:
+        yield cache
+    finally:
+        active_cache.reset(token)
+        log.debug("Command cache hits: %s, misses: %s",
+                  cache.hits, cache.misses)
@@ -1,21 +1,152 @@
+import asyncio
+import contextvars
 import csv
 import io
+import json
 import subprocess
+import threading
+import time
 import yaml
 
+from concurrent.futures import ThreadPoolExecutor
+
+from .command_cache import active_cache
+from .instrumentation import metrics
+from ..exceptions import CMCommandTimeoutException
 from ..exceptions import CMRunCommandException
 
+# Use the libyaml based loader when available, which is much faster than
+# the pure python loader for large documents.
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+# Maximum time in seconds that a command may run for before it is killed.
+# Set by the AsyncCommandRunner for the calls it runs.
+command_timeout = contextvars.ContextVar('command_timeout', default=None)
+# When set, run_command and stream_command add each process they start to
+# this set while the process is running, so that the processes can be killed
+# on cancellation.
+running_processes = contextvars.ContextVar('running_processes', default=None)
+
 
-def run_command(command, shell=False, stderr=None):
+def cancel_process(process):
     """
-    Runs a command and returns stdout
+    Kills a process started by run_command or stream_command on behalf of
+    its caller, so that it is recorded as cancelled rather than as failed.
     """
+    process.cancelled = True
+    process.kill()
+
+
+def _outcome(process):
+    if getattr(process, 'cancelled', False):
+        return "cancelled"
+    return process.returncode
+
+
+def run_command(command, shell=False, stderr=None, input=None):
+    """
+    Runs a command and returns stdout. If input is given, it is written to
+    the command's stdin. Within a cached_commands() block, the output of
+    read-only kubectl and helm commands is cached.
+    """
+    cache = active_cache.get()
+    if cache is not None:
+        # Always look up the command, so that writes invalidate cached
+        # reads, but never serve or cache output that depends on input
+        output = cache.lookup(command)
+        if output is not None and input is None:
+            return output
+    output = _run_process(command, shell=shell, stderr=stderr, input=input)
+    if cache is not None and input is None:
+        cache.store(command, output)
+    return output
+
+
+def _run_process(command, shell=False, stderr=None, input=None):
+    timeout = command_timeout.get()
+    processes = running_processes.get()
+    start = time.monotonic()
+    with subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=stderr,
+            stdin=subprocess.PIPE if input is not None else None,
+            universal_newlines=True, shell=shell,
+            encoding='utf-8') as process:
+        if processes is not None:
+            processes.add(process)
+        try:
+            output, _ = process.communicate(input=input, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            metrics.observe(command, time.monotonic() - start, "timeout", 0)
+            raise CMCommandTimeoutException(
+                f"Command did not complete within {timeout} seconds")
+        finally:
+            if processes is not None:
+                processes.discard(process)
+    metrics.observe(command, time.monotonic() - start, _outcome(process),
+                    len(output.encode('utf-8')) if output else 0)
+    if process.returncode:
+        raise CMRunCommandException(f"Error running command: {output}")
+    return output
+
+
+def stream_command(command, stderr=None):
+    """
+    Runs a command and yields its stdout line by line as it is produced.
+    The process is terminated if the caller stops iterating early.
+    """
+    cache = active_cache.get()
+    cached = cache.lookup(command) if cache is not None else None
+    if cached is not None:
+        yield from io.StringIO(cached)
+        return
+    timeout = command_timeout.get()
+    start = time.monotonic()
+    output_bytes = 0
+    processes = running_processes.get()
+    process = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=stderr,
+        universal_newlines=True, encoding='utf-8')
+    if processes is not None:
+        processes.add(process)
+    timed_out = threading.Event()
+    timer = None
+    if timeout is not None:
+        # The output is read as the caller consumes it, so the process is
+        # killed from a timer rather than while waiting for its output.
+        def kill():
+            timed_out.set()
+            process.kill()
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
     try:
-        return subprocess.check_output(
-            command, universal_newlines=True, shell=shell, encoding='utf-8',
-            stderr=stderr)
-    except subprocess.CalledProcessError as e:
-        raise CMRunCommandException(f"Error running command: {e.output}")
+        for line in process.stdout:
+            output_bytes += len(line.encode('utf-8'))
+            yield line
+        process.wait()
+        if timed_out.is_set():
+            raise CMCommandTimeoutException(
+                f"Command did not complete within {timeout} seconds")
+        if process.returncode != 0:
+            raise CMRunCommandException(
+                f"Error running command: {command[:3]} exited with"
+                f" code {process.returncode}")
+    finally:
+        if timer:
+            timer.cancel()
+        if process.poll() is None:
+            # the caller stopped reading early
+            cancel_process(process)
+        process.stdout.close()
+        process.wait()
+        if processes is not None:
+            processes.discard(process)
+        metrics.observe(command, time.monotonic() - start,
+                        "timeout" if timed_out.is_set() else
+                        _outcome(process), output_bytes)
 
 
 def run_list_command(command, delimiter="\t", skipinitialspace=True):
@@ -32,9 +163,134 @@ def run_list_command(command, delimiter="\t", skipinitialspace=True):
     return output
 
 
+def stream_list_command(command, delimiter="\t", skipinitialspace=True):
+    """
+    Runs a command, and parses the output as tab separated columnar output
+    in the same way as run_list_command. However, rows are yielded one at a
+    time as they are read from the command's output, so that callers can
+    stop as soon as they find what they are looking for.
+    """
+    lines = stream_command(command)
+    try:
+        reader = csv.DictReader(lines, delimiter=delimiter,
+                                skipinitialspace=skipinitialspace)
+        for row in reader:
+            yield {key.strip(): val.strip() for key, val in row.items()}
+    finally:
+        lines.close()
+
+
 def run_yaml_command(command):
     """
-    Runs a command, and parses the output as yaml.
+    Runs a command, and parses the output as yaml. Prefer run_json_command
+    for commands which can produce json output.
+    """
+    output = run_command(command)
+    return yaml.load(output, Loader=YAML_LOADER)
+
+
+def run_json_command(command):
+    """
+    Runs a command, and parses the output as json. The command itself must
+    be told to produce json, for example with kubectl's or helm's -o json.
     """
     output = run_command(command)
-    return yaml.safe_load(output)
+    return json.loads(output) if output and output.strip() else None
+
+
+class AsyncCommandRunner(object):
+    """
+    Runs blocking client calls, such as KubeClient and HelmClient service
+    methods, from asyncio code. Calls run in a bounded pool of worker
+    threads, so at most max_concurrency commands run at the same time, and
+    each command they run is killed if it exceeds the timeout. Cancelling
+    the awaiting task kills any command the call is still running.
+
+    Synchronous code can run several calls concurrently through run_all.
+    Usage:
+        runner = AsyncCommandRunner(max_concurrency=4, timeout=60)
+        values = runner.run_all(
+            functools.partial(client.releases.get_values, ns, name)
+            for name in names)
+    """
+
+    def __init__(self, max_concurrency=8, timeout=None):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._executor = None
+
+    def _get_executor(self):
+        if not self._executor:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency,
+                thread_name_prefix="cm-command-runner")
+        return self._executor
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Runs func(*args, **kwargs) in a worker thread and returns its result.
+        """
+        processes = set()
+
+        def run():
+            command_timeout.set(self.timeout)
+            running_processes.set(processes)
+            return func(*args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        try:
+            return await loop.run_in_executor(
+                self._get_executor(), context.run, run)
+        except asyncio.CancelledError:
+            for process in list(processes):
+                cancel_process(process)
+            raise
+
+    async def gather(self, calls, return_exceptions=False):
+        """
+        Runs each zero argument callable in calls concurrently, and returns
+        their results in the same order.
+        """
+        return await asyncio.gather(
+            *(self.call(call) for call in calls),
+            return_exceptions=return_exceptions)
+
+    def run_all(self, calls, return_exceptions=False):
+        """
+        Synchronous adapter for gather, for use by code which is not running
+        in an event loop.
+        """
+        return asyncio.run(
+            self.gather(list(calls), return_exceptions=return_exceptions))
+
+
+class AsyncServiceProxy(object):
+    """
+    Exposes the methods of a client service as coroutines which run through
+    an AsyncCommandRunner. Non-callable attributes are returned unchanged.
+    """
+
+    def __init__(self, service, runner):
+        self._service = service
+        self._runner = runner
+
+    def __getattr__(self, name):
+        attr = getattr(self._service, name)
+        if not callable(attr):
+            return attr
+
+        async def method(*args, **kwargs):
+            return await self._runner.call(attr, *args, **kwargs)
+        return method
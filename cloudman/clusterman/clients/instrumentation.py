@@ -0,0 +1,156 @@
+"""
+Latency, exit code and output size metrics for the kubectl and helm
+commands run by CloudMan.
+"""
+import contextvars
+import os
+import threading
+
+from . import command_cache
+
+# Upper bounds, in seconds, of the command duration histogram buckets
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+HELM_SUBCOMMANDS = {
+    'get': {'values', 'manifest', 'notes', 'hooks', 'all'},
+    'repo': {'add', 'remove', 'update', 'list', 'index'},
+    'search': {'repo', 'hub'},
+}
+
+
+def command_label(command):
+    """
+    Returns a label identifying the kind of command, such as
+    'kubectl get nodes' or 'helm repo update'. Only known subcommands and
+    resource kinds are included, so that resource names, values and other
+    arguments never appear in metrics.
+    """
+    if not isinstance(command, (list, tuple)) or not command:
+        return "shell"
+    prog = os.path.basename(command[0])
+    positional = [arg for arg in command[1:] if not arg.startswith("-")]
+    verb = positional[0] if positional else None
+    target = positional[1] if len(positional) > 1 else None
+    if prog == "kubectl" and verb and verb.isalpha():
+        kind = command_cache.KUBE_KINDS.get(target.split("/")[0]
+                                            if target else None)
+        return " ".join(filter(None, [prog, verb, kind]))
+    elif prog == "helm" and verb and verb.isalpha():
+        subcommand = (target if target in HELM_SUBCOMMANDS.get(verb, ())
+                      else None)
+        return " ".join(filter(None, [prog, verb, subcommand]))
+    return prog
+
+
+class CommandMetrics(object):
+    """
+    A process wide registry of command metrics, which can be rendered in
+    the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._exit_codes = {}
+        self._output_bytes = {}
+
+    def observe(self, command, duration, exit_code, output_bytes):
+        label = command_label(command)
+        with self._lock:
+            buckets, total, count = self._durations.get(
+                label, ([0] * len(DURATION_BUCKETS), 0.0, 0))
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    buckets[i] += 1
+            self._durations[label] = (buckets, total + duration, count + 1)
+            key = (label, str(exit_code))
+            self._exit_codes[key] = self._exit_codes.get(key, 0) + 1
+            self._output_bytes[label] = (
+                self._output_bytes.get(label, 0) + output_bytes)
+        summary = request_summary.get()
+        if summary is not None:
+            summary.record(label, duration)
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+            self._exit_codes.clear()
+            self._output_bytes.clear()
+
+    @staticmethod
+    def _escape(value):
+        return (value.replace("\\", "\\\\").replace('"', '\\"')
+                .replace("\n", "\\n"))
+
+    def render_prometheus(self):
+        lines = [
+            "# HELP cloudman_command_duration_seconds Wall time spent running"
+            " external commands.",
+            "# TYPE cloudman_command_duration_seconds histogram"]
+        with self._lock:
+            for label, (buckets, total, count) in sorted(
+                    self._durations.items()):
+                label = self._escape(label)
+                for bound, bucket_count in zip(DURATION_BUCKETS, buckets):
+                    lines.append(
+                        f'cloudman_command_duration_seconds_bucket{{command='
+                        f'"{label}",le="{bound}"}} {bucket_count}')
+                lines.append(
+                    f'cloudman_command_duration_seconds_bucket{{command='
+                    f'"{label}",le="+Inf"}} {count}')
+                lines.append(f'cloudman_command_duration_seconds_sum'
+                             f'{{command="{label}"}} {total}')
+                lines.append(f'cloudman_command_duration_seconds_count'
+                             f'{{command="{label}"}} {count}')
+            lines += [
+                "# HELP cloudman_command_exit_total Completed external"
+                " commands by exit code, or timeout or cancelled.",
+                "# TYPE cloudman_command_exit_total counter"]
+            for (label, exit_code), count in sorted(self._exit_codes.items()):
+                lines.append(
+                    f'cloudman_command_exit_total{{command='
+                    f'"{self._escape(label)}",exit_code="{exit_code}"}}'
+                    f' {count}')
+            lines += [
+                "# HELP cloudman_command_output_bytes_total Bytes of output"
+                " read from external commands.",
+                "# TYPE cloudman_command_output_bytes_total counter"]
+            for label, total in sorted(self._output_bytes.items()):
+                lines.append(
+                    f'cloudman_command_output_bytes_total{{command='
+                    f'"{self._escape(label)}"}} {total}')
+        lines += [
+            "# HELP cloudman_command_cache_total Command cache lookups.",
+            "# TYPE cloudman_command_cache_total counter"]
+        for result, count in sorted(command_cache.stats.items()):
+            lines.append(
+                f'cloudman_command_cache_total{{result="{result}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = CommandMetrics()
+
+
+class RequestSummary(object):
+    """
+    Totals the number and duration of commands run while handling a single
+    request, by command label.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {}
+
+    def record(self, label, duration):
+        with self._lock:
+            count, total = self.totals.get(label, (0, 0.0))
+            self.totals[label] = (count + 1, total + duration)
+
+    def as_header(self):
+        return "; ".join(f"{label}={count}/{total:.3f}s" for label, (
+            count, total) in sorted(self.totals.items()))
+
+
+# The summary of the request currently being handled, if summaries have been
+# enabled for it.
+request_summary = contextvars.ContextVar('request_summary', default=None)
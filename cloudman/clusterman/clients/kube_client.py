@@ -1,9 +1,52 @@
 """A wrapper around the kubectl commandline client"""
+import re
 import shutil
+import subprocess
+import time
+
+from collections import defaultdict
 
 import tenacity
 
 from . import helpers
+from . import kube_informer
+from ..exceptions import CMRunCommandException
+
+# Label names and values that can be expressed in a label selector.
+# https://kubernetes.io/docs/concepts/overview/working-with-objects/labels/
+LABEL_NAME_REGEX = re.compile(
+    r'^[A-Za-z0-9]([-A-Za-z0-9_.]{0,61}[A-Za-z0-9])?$')
+LABEL_PREFIX_REGEX = re.compile(
+    r'^[a-z0-9]([-a-z0-9]*[a-z0-9])?(\.[a-z0-9]([-a-z0-9]*[a-z0-9])?)*$')
+
+
+# Matches the per node result lines printed by kubectl, such as
+# "node/node1 cordoned" or "node/node1 already cordoned", including when
+# the output has been prefixed with an error message
+NODE_RESULT_REGEX = re.compile(r'(?:^|\s)node/(\S+) ([^\n]+?)[ \t]*$',
+                               re.MULTILINE)
+
+
+def label_selector(labels):
+    """
+    Converts a dict of labels into an equality based label selector such as
+    ``key1=value1,key2=value2``. Returns None if any of the labels cannot be
+    expressed as a selector, in which case the caller must filter client side.
+    """
+    terms = []
+    for key, value in labels.items():
+        if not isinstance(key, str) or not isinstance(value, str):
+            return None
+        prefix, _, name = key.rpartition("/")
+        if prefix and (len(prefix) > 253 or
+                       not LABEL_PREFIX_REGEX.match(prefix)):
+            return None
+        if not LABEL_NAME_REGEX.match(name):
+            return None
+        if value and not LABEL_NAME_REGEX.match(value):
+            return None
+        terms.append(f"{key}={value}")
+    return ",".join(terms)
 
 
 class KubeService(object):
@@ -21,7 +64,8 @@ class KubeClient(KubeService):
         self._check_environment()
         super(KubeClient, self).__init__(self)
         self._namespace_svc = KubeNamespaceService(self)
-        self._node_svc = KubeNodeService(self)
+        self._node_svc = KubeNodeService(
+            self, informer=kube_informer.get_informer("nodes"))
         self._secret_svc = KubeSecretService(self)
 
     @staticmethod
@@ -42,6 +86,31 @@ class KubeClient(KubeService):
         return self._secret_svc
 
 
+class AsyncKubeClient(object):
+    """
+    Asyncio counterpart of KubeClient. Each service method is a coroutine
+    which runs the corresponding KubeClient method through an
+    AsyncCommandRunner, for example:
+        nodes = await AsyncKubeClient().nodes.find(labels=labels)
+    """
+
+    def __init__(self, client=None, runner=None):
+        self.client = client or KubeClient()
+        self.runner = runner or helpers.AsyncCommandRunner()
+
+    @property
+    def namespaces(self):
+        return helpers.AsyncServiceProxy(self.client.namespaces, self.runner)
+
+    @property
+    def nodes(self):
+        return helpers.AsyncServiceProxy(self.client.nodes, self.runner)
+
+    @property
+    def secrets(self):
+        return helpers.AsyncServiceProxy(self.client.secrets, self.runner)
+
+
 class KubeNamespaceService(KubeService):
 
     def __init__(self, client):
@@ -52,6 +121,24 @@ class KubeNamespaceService(KubeService):
                                         delimiter=" ", skipinitialspace=True)
         return data
 
+    def get(self, namespace_name):
+        """
+        Returns the namespace with the given name, in the same form as the
+        entries returned by list, or None if the namespace does not exist.
+        Any other error is raised.
+        """
+        data = helpers.run_list_command(
+            ["kubectl", "get", "namespaces", namespace_name,
+             "--ignore-not-found"], delimiter=" ", skipinitialspace=True)
+        return data[0] if data else None
+
+    def stream(self):
+        """
+        Yields namespaces one at a time as they are read from kubectl.
+        """
+        return helpers.stream_list_command(["kubectl", "get", "namespaces"],
+                                           delimiter=" ", skipinitialspace=True)
+
     # def _list_names(self):
     #     data = self.list()
     #     output = [each.get('NAME') for each in data]
@@ -72,48 +159,170 @@ class KubeNamespaceService(KubeService):
 
 class KubeNodeService(KubeService):
 
-    def __init__(self, client):
+    def __init__(self, client, informer=None, sync_timeout=30):
         super(KubeNodeService, self).__init__(client)
+        self._informer = informer
+        self._sync_timeout = sync_timeout
 
-    def list(self):
-        data = helpers.run_yaml_command(["kubectl", "get", "nodes", "-o", "yaml"])
+    def _informer_ready(self):
+        # Fall back to querying kubectl directly if the informer's initial
+        # listing has not completed in time
+        return (self._informer is not None and
+                self._informer.wait_for_sync(self._sync_timeout))
+
+    def list(self, selector=None):
+        """
+        Lists nodes, optionally restricted server side by a label selector.
+        """
+        if self._informer_ready() and not selector:
+            return self._informer.list()
+        command = ["kubectl", "get", "nodes", "-o", "json"]
+        if selector:
+            command += ["--selector", selector]
+        data = helpers.run_json_command(command)
         return data['items']
 
+    def index(self, selector=None):
+        """
+        Returns a KubeNodeIndex over the current set of nodes. When an
+        informer is in use, the index is shared until the node store changes.
+        """
+        if self._informer_ready():
+            return self._informer.index(KubeNodeIndex)
+        return KubeNodeIndex(self.list(selector=selector))
+
     def find(self, address=None, labels=None):
-        labels = labels or {}
-        nodes = self.list()
-        if address:
-            nodes = [node for node in nodes if address
-                     in [addr.get('address') for addr in
-                         node.get('status', {}).get('addresses', {})]]
-        if labels:
-            nodes = [node for node in nodes if labels.items()
-                     <= node.get('metadata', {}).get('labels', {}).items()]
-        return nodes
+        # Labels are pushed to the server as a label selector when possible,
+        # so that only matching nodes are returned by kubectl. Node addresses
+        # are not supported by field selectors, so these are always matched
+        # client side, as are any labels a selector cannot express.
+        selector = label_selector(labels) if labels else None
+        return self.index(selector=selector).find(
+            address=address, labels=labels)
 
     def cordon(self, node):
         name = node.get('metadata', {}).get('name')
         return helpers.run_command(["kubectl", "cordon", name])
 
+    @staticmethod
+    def _run_bulk_command(command, names):
+        """
+        Runs a kubectl command affecting many nodes, and returns a dict
+        mapping each node name to kubectl's result for it, such as
+        "cordoned" or "labeled", or to an exception if the command failed
+        for that node.
+        """
+        try:
+            output = helpers.run_command(command, stderr=subprocess.STDOUT)
+            error = None
+        except CMRunCommandException as e:
+            output = str(e)
+            error = e
+        results = dict(NODE_RESULT_REGEX.findall(output or ""))
+        if error and not results and not names:
+            raise error
+        for name in names:
+            if name not in results:
+                results[name] = error or CMRunCommandException(
+                    f"No result reported for node: {name}")
+        return results
+
+    def cordon_many(self, nodes=None, selector=None):
+        """
+        Cordons all of the given nodes, or all nodes matching a label
+        selector, in a single kubectl call. Returns a dict of per node
+        results, as for _run_bulk_command.
+        """
+        names = [node.get('metadata', {}).get('name') for node in nodes or []]
+        if selector:
+            return self._run_bulk_command(
+                ["kubectl", "cordon", "--selector", selector], names)
+        if not names:
+            return {}
+        return self._run_bulk_command(["kubectl", "cordon"] + names, names)
+
+    def set_label_many(self, labels, nodes=None, selector=None):
+        """
+        Applies labels to all of the given nodes, or all nodes matching a
+        label selector, in a single kubectl call. Returns a dict of per node
+        results, as for _run_bulk_command.
+        """
+        names = [node.get('metadata', {}).get('name') for node in nodes or []]
+        label_args = [f"{key}={value}" for key, value in labels.items()]
+        if selector:
+            return self._run_bulk_command(
+                ["kubectl", "label", "nodes", "--selector", selector]
+                + label_args, names)
+        if not names:
+            return {}
+        return self._run_bulk_command(
+            ["kubectl", "label", "nodes"] + names + label_args, names)
+
+    def _get_job_pods(self, state, node_name=None):
+        """
+        Return a list of all pods in a particular state, such as Running,
+        optionally restricted to a single node. Only looks for pods that
+        belong to a job (job-name selector).
+        """
+        field_selector = f"status.phase={state}"
+        if node_name:
+            field_selector = f"spec.nodeName={node_name},{field_selector}"
+        return helpers.run_json_command(
+            ["kubectl", "get", "pods", "--all-namespaces", "--field-selector",
+             field_selector, "--selector", "job-name", "-o", "json"])
+
     def _get_job_pods_in_node(self, node_name, state):
         """
         Return a list of all pods in a node in a particular state, such
         as Running. Only looks for pods that belong to a job
         (job-name selector).
         """
-        return helpers.run_yaml_command(
-            ["kubectl", "get", "pods", "--all-namespaces", "--field-selector",
-             f"spec.nodeName={node_name},status.phase={state}",
-             "--selector", "job-name", "-o", "yaml"])
+        return self._get_job_pods(state, node_name=node_name)
 
-    def wait_till_jobs_complete(self, node, timeout=3600*24*7):
+    def count_job_pods_by_node(self, state="Running"):
+        """
+        Returns a dict mapping node names to the number of job pods in the
+        given state on each node, fetched for the whole cluster in a single
+        call. Nodes without any such pods are omitted.
+        """
+        pods = self._get_job_pods(state).get('items', [])
+        return {node_name: len(node_pods) for node_name, node_pods
+                in pods_by_node(pods).items() if node_name}
+
+    def _job_pods_remaining(self, informer, node_name, poll_interval):
+        """
+        Returns the number of running job pods on a node, waiting up to
+        poll_interval for it to drop to zero. Falls back to querying kubectl
+        directly while the pod watch is unavailable.
+        """
+        if informer.has_synced():
+            informer.wait_for(
+                lambda: not informer.index(pods_by_node).get(node_name),
+                timeout=poll_interval)
+            if informer.has_synced():
+                return len(informer.index(pods_by_node).get(node_name, []))
+        remaining = len(self._get_job_pods_in_node(
+            node_name, "Running").get('items', []))
+        if remaining:
+            time.sleep(poll_interval)
+        return remaining
+
+    def wait_till_jobs_complete(self, node, timeout=3600*24*7,
+                                poll_interval=5):
+        """
+        Waits until no job pods are running on the node. Running job pods
+        are tracked through a watch shared by all nodes being waited on in
+        this process, so this returns as soon as the last job finishes.
+        """
         name = node.get('metadata', {}).get('name')
-        retryer = tenacity.Retrying(
-            stop=tenacity.stop_after_delay(timeout),
-            retry=tenacity.retry_if_result(
-                lambda result: len(result.get('items', [])) != 0),
-            wait=tenacity.wait_fixed(5))
-        retryer(self._get_job_pods_in_node, name, "Running")
+        with kube_informer.shared_informer(*RUNNING_JOB_PODS) as informer:
+            # give the watch a chance to start before falling back to polling
+            informer.wait_for_sync(self._sync_timeout)
+            retryer = tenacity.Retrying(
+                stop=tenacity.stop_after_delay(timeout),
+                retry=tenacity.retry_if_result(lambda remaining: remaining),
+                wait=tenacity.wait_none())
+            retryer(self._job_pods_remaining, informer, name, poll_interval)
 
     def drain(self, node, force=True, timeout=120, ignore_daemonsets=True):
         name = node.get('metadata', {}).get('name')
@@ -137,14 +346,83 @@ class KubeNodeService(KubeService):
         )
 
 
+# Arguments for listing the running pods that belong to jobs
+RUNNING_JOB_PODS = ("pods", "--all-namespaces", "--selector", "job-name",
+                    "--field-selector", "status.phase=Running")
+
+
+def pods_by_node(pods):
+    """
+    Groups pods by the name of the node they are scheduled on.
+    """
+    grouped = defaultdict(list)
+    for pod in pods:
+        grouped[pod.get('spec', {}).get('nodeName')].append(pod)
+    return dict(grouped)
+
+
+class KubeNodeIndex(object):
+    """
+    Inverted indexes over a snapshot of nodes, mapping each label key/value
+    pair and each address to the names of the nodes that have them. Lookups
+    by label or address are dictionary lookups instead of a scan of the
+    whole fleet.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self._positions = {}
+        self._by_name = {}
+        self._by_label = defaultdict(set)
+        self._by_address = defaultdict(set)
+        for position, node in enumerate(nodes):
+            metadata = node.get('metadata', {})
+            name = metadata.get('name')
+            self._positions[name] = position
+            self._by_name[name] = node
+            for item in (metadata.get('labels') or {}).items():
+                self._by_label[item].add(name)
+            for addr in node.get('status', {}).get('addresses') or []:
+                if addr.get('address'):
+                    self._by_address[addr.get('address')].add(name)
+
+    def get(self, name):
+        return self._by_name.get(name)
+
+    def _label_matches(self, item):
+        try:
+            return self._by_label.get(item, set())
+        except TypeError:
+            # unhashable label values can never match a node label
+            return set()
+
+    def find(self, address=None, labels=None):
+        """
+        Returns the nodes having the given address and all of the given
+        labels, in their original order.
+        """
+        matches = None
+        criteria = [self._by_address.get(address, set())] if address else []
+        criteria += [self._label_matches(item)
+                     for item in (labels or {}).items()]
+        for names in criteria:
+            matches = names if matches is None else matches & names
+            if not matches:
+                return []
+        if matches is None:
+            return list(self.nodes)
+        return [self._by_name[name] for name in
+                sorted(matches, key=self._positions.get)]
+
+
 class KubeSecretService(KubeService):
 
     def __init__(self, client):
         super(KubeSecretService, self).__init__(client)
 
     def get(self, secret_name, namespace=None):
-        command = ["kubectl", "get", "secrets", "-o", "yaml", secret_name]
+        command = ["kubectl", "get", "secrets", "-o", "json", secret_name]
         if namespace:
             command += ["-n", namespace]
-        data = helpers.run_yaml_command(command)
+        data = helpers.run_json_command(command)
         return data
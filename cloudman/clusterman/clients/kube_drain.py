@@ -0,0 +1,123 @@
+"""
+Removes many kubernetes nodes at once, by pipelining the steps of removing
+each node.
+"""
+import functools
+import logging
+
+from . import helpers
+from .kube_client import KubeClient
+from ..exceptions import CMRunCommandException
+
+log = logging.getLogger(__name__)
+
+
+class KubeNodeDrainPipeline(object):
+    """
+    Removes a set of nodes from the cluster. All nodes are cordoned up
+    front in a single call, so that no new jobs are scheduled on any of
+    them. Each node is then taken through waiting for its jobs to complete,
+    draining, and deletion from the cluster, with at most max_parallel nodes
+    in progress at a time. Each node is released, for example by deleting
+    its VM, as soon as its own removal completes.
+
+    As with removing a single node, a node is deleted and released even if
+    waiting for its jobs or draining it fails.
+
+    The progress callback, if given, is called with the node name and the
+    stage it has reached: one of cordoned, jobs_complete, drained, deleted,
+    released or failed.
+
+    Each node is removed in a worker thread. The cleanup callback, if given,
+    is called in that thread once the node's last progress report has been
+    made, for example to close the thread's database connection.
+    Usage:
+        pipeline = KubeNodeDrainPipeline(
+            release=lambda node: print(f"deleting VM of {node}"))
+        errors = pipeline.run(kube_client.nodes.find(labels=labels))
+    """
+    CORDONED = 'cordoned'
+    JOBS_COMPLETE = 'jobs_complete'
+    DRAINED = 'drained'
+    DELETED = 'deleted'
+    RELEASED = 'released'
+    FAILED = 'failed'
+
+    def __init__(self, kube_client=None, max_parallel=5, drain_timeout=120,
+                 release=None, progress=None, cleanup=None):
+        self.kube_client = kube_client or KubeClient()
+        self.max_parallel = max_parallel
+        self.drain_timeout = drain_timeout
+        self.release = release
+        self.progress = progress
+        self.cleanup = cleanup
+
+    @staticmethod
+    def _name(node):
+        return node.get('metadata', {}).get('name')
+
+    def _report(self, node, stage):
+        log.debug("Node %s: %s", self._name(node), stage)
+        if self.progress:
+            try:
+                self.progress(self._name(node), stage)
+            except Exception:
+                log.exception("Error reporting progress of node %s",
+                              self._name(node))
+
+    def _cordon_all(self, nodes):
+        try:
+            results = self.kube_client.nodes.cordon_many(nodes)
+        except CMRunCommandException as e:
+            results = {self._name(node): e for node in nodes}
+        for node in nodes:
+            result = results.get(self._name(node))
+            if isinstance(result, Exception):
+                log.warning("Could not cordon node %s: %s",
+                            self._name(node), result)
+            else:
+                self._report(node, self.CORDONED)
+
+    def _remove(self, node):
+        try:
+            try:
+                self.kube_client.nodes.wait_till_jobs_complete(node)
+                self._report(node, self.JOBS_COMPLETE)
+                self.kube_client.nodes.drain(node, timeout=self.drain_timeout)
+                self._report(node, self.DRAINED)
+            finally:
+                self.kube_client.nodes.delete(node)
+                self._report(node, self.DELETED)
+        finally:
+            if self.release:
+                self.release(node)
+                self._report(node, self.RELEASED)
+
+    def _remove_and_report(self, node):
+        try:
+            self._remove(node)
+        except Exception:
+            self._report(node, self.FAILED)
+            raise
+        finally:
+            if self.cleanup:
+                self.cleanup()
+
+    def run(self, nodes):
+        """
+        Removes the given k8s nodes, and returns a dict mapping the name of
+        each node to the exception its removal raised, or to None if it was
+        removed successfully.
+        """
+        nodes = list(nodes)
+        if not nodes:
+            return {}
+        with helpers.AsyncCommandRunner(
+                max_concurrency=self.max_parallel) as runner:
+            self._cordon_all(nodes)
+            results = runner.run_all(
+                (functools.partial(self._remove_and_report, node)
+                 for node in nodes), return_exceptions=True)
+        return {self._name(node): (result if isinstance(result, Exception)
+                                   else None)
+                for node, result in zip(nodes, results)}
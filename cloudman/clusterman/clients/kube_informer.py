@@ -0,0 +1,342 @@
+"""
+An in-process cache of kubernetes resources, kept up to date by a long-lived
+``kubectl get --watch`` stream.
+"""
+import contextlib
+import json
+import logging
+import os
+import threading
+
+from . import helpers
+from ..exceptions import CMRunCommandException
+
+log = logging.getLogger(__name__)
+
+
+def _resource_version(obj):
+    return obj.get('metadata', {}).get('resourceVersion')
+
+
+def _newer_version(current, candidate):
+    """
+    Resource versions are opaque strings, but are integers in practice.
+    Compare them numerically when possible so that stale events can be
+    discarded, and treat any change as newer otherwise.
+    """
+    if current is None:
+        return True
+    try:
+        return int(candidate) > int(current)
+    except (TypeError, ValueError):
+        return candidate != current
+
+
+def iter_json_objects(lines):
+    """
+    Decodes a stream of concatenated JSON documents, such as those printed
+    by ``kubectl get --watch -o json``, yielding each document as soon as
+    it is complete.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    for line in lines:
+        buffer += line
+        # kubectl pretty prints each document, so a document can only be
+        # complete once a closing brace appears at the start of a line.
+        if not line.startswith("}"):
+            continue
+        buffer = buffer.lstrip()
+        while buffer:
+            try:
+                obj, end = decoder.raw_decode(buffer)
+            except ValueError:
+                break
+            yield obj
+            buffer = buffer[end:].lstrip()
+
+
+class _WatchProcesses(set):
+    """
+    The processes started by an informer's thread. A process added once the
+    informer has been stopped is killed straight away, so that a watch
+    started while stop() was running does not outlive the informer.
+    """
+
+    def __init__(self, stopped):
+        super().__init__()
+        self.stopped = stopped
+
+    def add(self, process):
+        super().add(process)
+        if self.stopped.is_set():
+            helpers.cancel_process(process)
+
+
+class KubeInformer(object):
+    """
+    Maintains an in-memory store of a kubernetes resource kind. The store is
+    populated by a full listing and is then kept current in a background
+    thread by a ``kubectl get --watch`` stream, which is relisted and
+    restarted whenever it ends. Each stream starts by replaying the current
+    state of every object, followed by the changes since, so no events are
+    lost between the listing and the stream. Resource versions are tracked
+    per object so that replayed and out of order events are ignored, and
+    objects which the replay did not mention are removed once it is over,
+    since they must have been deleted before the stream started.
+
+    Objects returned from the store are shared and must be treated as
+    read-only.
+    """
+
+    def __init__(self, resource, extra_args=None, resync_period=300,
+                 retry_delay=5):
+        self.resource = resource
+        self.extra_args = extra_args or []
+        self.resync_period = resync_period
+        self.retry_delay = retry_delay
+        self.resource_version = None
+        self._store = {}
+        self._version = 0
+        self._indexes = {}
+        self._lock = threading.Condition()
+        self._synced = threading.Event()
+        self._listed = threading.Event()
+        self._stopped = threading.Event()
+        self._processes = _WatchProcesses(self._stopped)
+        self._thread = None
+
+    @staticmethod
+    def _key(obj):
+        metadata = obj.get('metadata', {})
+        if metadata.get('namespace'):
+            return f"{metadata.get('namespace')}/{metadata.get('name')}"
+        return metadata.get('name')
+
+    @property
+    def version(self):
+        """
+        A counter which is incremented on every change to the store. Useful
+        for invalidating anything derived from a snapshot of the store.
+        """
+        return self._version
+
+    @property
+    def is_running(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def start(self):
+        # A thread which is still shutting down carries on if restarted
+        self._stopped.clear()
+        if not self.is_running:
+            self._thread = threading.Thread(
+                target=self._run, name=f"kube-informer-{self.resource}",
+                daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._synced.clear()
+        self._listed.clear()
+        # end any watch in progress instead of waiting for it to time out
+        for process in list(self._processes):
+            helpers.cancel_process(process)
+
+    def wait_for_sync(self, timeout=None):
+        """
+        Waits for the first listing attempt to complete, and returns whether
+        the store is currently in sync.
+        """
+        self._listed.wait(timeout)
+        return self._synced.is_set()
+
+    def has_synced(self):
+        return self._synced.is_set()
+
+    def list(self):
+        with self._lock:
+            return list(self._store.values())
+
+    def get(self, key):
+        with self._lock:
+            return self._store.get(key)
+
+    def snapshot(self):
+        """
+        Returns the store version along with its contents, taken atomically.
+        """
+        with self._lock:
+            return self._version, list(self._store.values())
+
+    def index(self, builder):
+        """
+        Returns ``builder(objects)`` for the current contents of the store.
+        The result is cached until the store next changes, so that indexes
+        are only rebuilt once for each snapshot.
+        """
+        with self._lock:
+            version, index = self._indexes.get(builder, (None, None))
+            if version != self._version:
+                index = builder(list(self._store.values()))
+                self._indexes[builder] = (self._version, index)
+            return index
+
+    def wait_for(self, predicate, timeout=None):
+        """
+        Blocks until ``predicate()`` is true or the timeout expires, and
+        returns the last result of the predicate. The predicate is called
+        with the store locked, each time the store changes, so it may use
+        list() or index() to inspect the store.
+        """
+        with self._lock:
+            return self._lock.wait_for(predicate, timeout)
+
+    def _base_command(self):
+        return ["kubectl", "get", self.resource] + self.extra_args
+
+    def _relist(self):
+        data = helpers.run_json_command(self._base_command() + ["-o", "json"])
+        with self._lock:
+            self._store = {self._key(obj): obj
+                           for obj in data.get('items', [])}
+            self.resource_version = _resource_version(data)
+            self._version += 1
+            self._lock.notify_all()
+        self._synced.set()
+        self._listed.set()
+
+    def _apply_event(self, event):
+        event_type = event.get('type')
+        obj = event.get('object') or {}
+        version = _resource_version(obj)
+        if event_type == 'ERROR':
+            raise CMRunCommandException(
+                f"Watch on {self.resource} failed: {obj.get('message')}")
+        with self._lock:
+            if _newer_version(self.resource_version, version):
+                self.resource_version = version
+            if event_type == 'BOOKMARK':
+                return
+            key = self._key(obj)
+            existing = self._store.get(key)
+            if event_type == 'DELETED':
+                if existing is None:
+                    return
+                del self._store[key]
+            elif (existing is None or _newer_version(
+                    _resource_version(existing), version)):
+                self._store[key] = obj
+            else:
+                return
+            self._version += 1
+            self._lock.notify_all()
+
+    def _prune(self, keys):
+        with self._lock:
+            removed = [key for key in keys if self._store.pop(key, None)]
+            if removed:
+                self._version += 1
+                self._lock.notify_all()
+
+    def _watch(self):
+        command = self._base_command() + [
+            "--watch", "--output-watch-events", "-o", "json",
+            f"--request-timeout={self.resync_period}s"]
+        with self._lock:
+            unseen = set(self._store)
+        for event in iter_json_objects(helpers.stream_command(command)):
+            if self._stopped.is_set():
+                return
+            if unseen is not None and event.get('type') != 'ADDED':
+                # kubectl replays every object as an ADDED event before any
+                # changes, so any object the replay did not mention has been
+                # deleted since the store was listed.
+                self._prune(unseen)
+                unseen = None
+            self._apply_event(event)
+            if unseen is not None:
+                unseen.discard(self._key(event.get('object') or {}))
+        if unseen is not None:
+            self._prune(unseen)
+
+    def _run(self):
+        # register watch processes so that stop() can kill them
+        helpers.running_processes.set(self._processes)
+        while not self._stopped.is_set():
+            try:
+                self._relist()
+            except Exception:
+                log.exception("Could not list %s", self.resource)
+                self._synced.clear()
+                self._listed.set()
+                self._stopped.wait(self.retry_delay)
+                continue
+            if self._stopped.is_set():
+                break
+            try:
+                # The watch ends when the request times out, after which the
+                # store is relisted, so that deletions missed while no watch
+                # was running are picked up straight away.
+                self._watch()
+            except CMRunCommandException as e:
+                log.debug("Watch on %s ended: %s", self.resource, e)
+            except Exception:
+                log.exception("Error while watching %s", self.resource)
+                self._stopped.wait(self.retry_delay)
+
+
+_informers = {}
+_informer_users = {}
+_informers_lock = threading.Lock()
+
+
+def informers_enabled():
+    return os.environ.get('CM_KUBE_INFORMERS', '').lower() in (
+        '1', 'true', 'yes')
+
+
+def get_informer(resource, *extra_args):
+    """
+    Returns a started, process-wide informer for the given resource, or None
+    if informers have not been enabled through the CM_KUBE_INFORMERS
+    environment variable. Informers are recreated in forked worker processes,
+    since the watching thread does not survive a fork.
+    """
+    if not informers_enabled():
+        return None
+    key = (os.getpid(), resource) + extra_args
+    with _informers_lock:
+        informer = _informers.get(key)
+        if not informer:
+            informer = KubeInformer(resource, extra_args=list(extra_args))
+            _informers[key] = informer
+        return informer.start()
+
+
+@contextlib.contextmanager
+def shared_informer(resource, *extra_args):
+    """
+    Context manager which returns a started, process-wide informer for the
+    given resource, regardless of whether informers have been enabled. All
+    users of the same resource within a process share a single watch, which
+    is stopped when the last of them exits, unless informers are enabled.
+    Usage:
+        with shared_informer("pods", "--all-namespaces") as informer:
+            informer.wait_for(lambda: not informer.list(), timeout=60)
+    """
+    key = (os.getpid(), resource) + extra_args
+    with _informers_lock:
+        informer = _informers.get(key)
+        if not informer:
+            informer = KubeInformer(resource, extra_args=list(extra_args))
+            _informers[key] = informer
+        _informer_users[key] = _informer_users.get(key, 0) + 1
+        informer.start()
+    try:
+        yield informer
+    finally:
+        with _informers_lock:
+            _informer_users[key] -= 1
+            if not _informer_users[key] and not informers_enabled():
+                informer.stop()
@@ -28,6 +28,14 @@ class CMClusterTemplate(object):
     def find_matching_node(self, labels=None):
         pass
 
+    @abc.abstractmethod
+    def count_active_jobs(self):
+        """
+        Returns a dict mapping the names of cluster nodes to the number of
+        jobs currently running on each.
+        """
+        pass
+
     @abc.abstractmethod
     def activate_autoscaling(self, min_nodes=0, max_nodes=None, size=None):
         pass
@@ -190,3 +198,17 @@ class CMRKETemplate(CMClusterTemplate):
                 if node.name == node_name:
                     return node
         return None
+
+    def count_active_jobs(self):
+        kube_client = KubeClient()
+        pods_per_node = kube_client.nodes.count_job_pods_by_node()
+        job_counts = {}
+        # map k8s node names to cloudman node names
+        for k8s_node in kube_client.nodes.list():
+            metadata = k8s_node.get('metadata', {})
+            node_name = (metadata.get('labels') or {}).get(
+                'usegalaxy.org/cm_node_name')
+            if node_name:
+                job_counts[node_name] = pods_per_node.get(
+                    metadata.get('name'), 0)
+        return job_counts
@@ -7,3 +7,7 @@ class CMDuplicateNameException(Exception):
 
 class CMRunCommandException(Exception):
     pass
+
+
+class CMCommandTimeoutException(CMRunCommandException):
+    pass
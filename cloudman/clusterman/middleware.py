@@ -0,0 +1,56 @@
+"""CloudMan middleware."""
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .clients import instrumentation
+from .clients.command_cache import cached_commands
+
+
+class CommandCacheMiddleware(object):
+    """
+    Caches the output of read-only kubectl and helm commands for the
+    duration of each request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with cached_commands():
+            return self.get_response(request)
+
+
+class CommandSummaryMiddleware(object):
+    """
+    When DEBUG is enabled, adds an X-CloudMan-Command-Summary header to each
+    response, giving the number and total duration of the commands and
+    database queries run while handling the request. For example:
+    ``db=4/0.012s; helm list=1/0.350s; kubectl get namespaces=1/0.120s``
+    """
+    header = 'X-CloudMan-Command-Summary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DEBUG:
+            return self.get_response(request)
+        summary = instrumentation.RequestSummary()
+        token = instrumentation.request_summary.set(summary)
+
+        def time_query(execute, sql, params, many, context):
+            start = time.monotonic()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                summary.record("db", time.monotonic() - start)
+
+        try:
+            with connection.execute_wrapper(time_query):
+                response = self.get_response(request)
+        finally:
+            instrumentation.request_summary.reset(token)
+        response[self.header] = summary.as_header()
+        return response
@@ -3,6 +3,7 @@ import logging as log
 from djcloudbridge import models as cb_models
 
 from .cluster_templates import CMClusterTemplate
+from .exceptions import CMRunCommandException
 
 
 class Cluster(object):
@@ -208,6 +209,19 @@ class ClusterAutoScaler(object):
              if node.is_stable()])
         )
 
+    def _find_emptiest_node(self, nodes):
+        """
+        Returns the node with the fewest running jobs. Nodes are ordered
+        from last to first launched, so ties go to the last launched node.
+        """
+        try:
+            job_counts = self.cluster.get_cluster_template().count_active_jobs()
+        except CMRunCommandException as e:
+            log.warning(f"Could not count jobs per node, falling back to the"
+                        f" last launched node: {e}")
+            return nodes[0]
+        return min(nodes, key=lambda node: job_counts.get(node.name, 0))
+
     def _filter_running_nodes(self, nodegroup):
         return list(reversed(
             [node for node in nodegroup.all()
@@ -252,10 +266,9 @@ class ClusterAutoScaler(object):
                           f" not found with labels: {labels}")
                     return
             else:
-                # if no host was specified,
-                # remove the last added node
-                last_node = nodes[0]
-                print(f"Non-targeted downscale deleting last launched"
-                      f" node: {last_node}")
-                node = self.cluster.nodes.get(last_node.id)
+                # if no host was specified, remove the node running the
+                # fewest jobs, preferring the last added node
+                candidate = self._find_emptiest_node(nodes)
+                print(f"Non-targeted downscale deleting node: {candidate}")
+                node = self.cluster.nodes.get(candidate.id)
                 node.delete()
@@ -3,10 +3,13 @@ from celery.app import shared_task
 from celery.result import AsyncResult
 from celery.result import allow_join_result
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import connection
 
 from clusterman import api
 from clusterman.clients.kube_client import KubeClient
+from clusterman.clients.kube_drain import KubeNodeDrainPipeline
 
 
 def node_not_present(node):
@@ -51,3 +54,55 @@ def delete_node(self, deployment_delete_task_id, cluster_id, node_id):
     else:
         print("Deleted node still exists, not removing clusterman"
               "node reference.")
+
+
+@shared_task(bind=True)
+def delete_nodes(self, cluster_id, node_ids):
+    """
+    Removes several nodes from the k8s cluster through a pipeline which
+    drains them in parallel, and deletes each node's deployment as soon as
+    the node has been removed from k8s. Per node progress is reported
+    through the task's state.
+    """
+    admin = User.objects.filter(is_superuser=True).first()
+    cmapi = api.CloudManAPI(api.CMServiceContext(user=admin))
+    cluster = cmapi.clusters.get(cluster_id)
+    nodes = {}
+    for node_id in node_ids:
+        node = cluster.nodes.get(node_id)
+        nodes[node.name] = node
+    kube_client = KubeClient()
+    index = kube_client.nodes.index()
+    k8s_nodes = {}
+    for name, node in nodes.items():
+        k8s_node = index.find(labels={'usegalaxy.org/cm_node_name': name})
+        if k8s_node:
+            k8s_nodes[name] = k8s_node[0]
+        else:
+            # nothing to drain, so release the node straight away
+            print(f"Node {name} not found in k8s, deleting its deployment.")
+            node.delete()
+    progress = {name: 'pending' for name in k8s_nodes}
+    cm_node_names = {k8s_node.get('metadata', {}).get('name'): name
+                     for name, k8s_node in k8s_nodes.items()}
+
+    def release(k8s_node):
+        name = cm_node_names[k8s_node.get('metadata', {}).get('name')]
+        nodes[name].delete()
+
+    def report(k8s_node_name, stage):
+        name = cm_node_names[k8s_node_name]
+        print(f"Node {name}: {stage}")
+        progress[name] = stage
+        self.update_state(state='PROGRESS', meta={'nodes': dict(progress)})
+
+    pipeline = KubeNodeDrainPipeline(
+        kube_client=kube_client,
+        max_parallel=settings.CLUSTERMAN_MAX_PARALLEL_DRAINS,
+        release=release, progress=report,
+        # releases and reports run in pipeline worker threads, which would
+        # otherwise leave their database connections open
+        cleanup=lambda: connection.close())
+    errors = pipeline.run(k8s_nodes.values())
+    return {cm_node_names[k8s_name]: str(error) if error else None
+            for k8s_name, error in errors.items()}
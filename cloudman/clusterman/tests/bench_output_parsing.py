@@ -0,0 +1,68 @@
+"""
+Micro-benchmark comparing the cost of decoding kubectl output as yaml and as
+json, using the MockKubeCtl fixtures scaled up to a large number of objects.
+
+Run from the cloudman directory with:
+    python -m clusterman.tests.bench_output_parsing [--count 5000]
+"""
+import argparse
+import copy
+import json
+import timeit
+
+import yaml
+
+from .mock_kubectl import MockKubeCtl
+
+
+def scale_fixtures(items, count):
+    scaled = []
+    for i in range(count):
+        item = copy.deepcopy(items[i % len(items)])
+        item['metadata']['name'] = f"{item['metadata']['name']}-{i}"
+        scaled.append(item)
+    return scaled
+
+
+def make_outputs(count):
+    kubectl = MockKubeCtl()
+    kubectl.nodes = scale_fixtures(kubectl.nodes, count)
+    kubectl.pods = scale_fixtures(kubectl.pods, count)
+
+    def get(kind, fmt):
+        # Mock pod listings alternate between full and empty responses, so
+        # reset the counter to always get a full response.
+        kubectl.request_counter = 0
+        return kubectl.run_command(["kubectl", "get", kind, "-o", fmt])
+
+    return {kind: {fmt: get(kind, fmt) for fmt in ("yaml", "json")}
+            for kind in ("nodes", "pods")}
+
+
+def benchmark(count, repeat):
+    decoders = {
+        'yaml (SafeLoader)': ('yaml', lambda text: yaml.load(
+            text, Loader=yaml.SafeLoader)),
+        'yaml (CSafeLoader)': ('yaml', lambda text: yaml.load(
+            text, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))),
+        'json': ('json', json.loads),
+    }
+    for kind, outputs in make_outputs(count).items():
+        print(f"{count} {kind}:")
+        for name, (fmt, decode) in decoders.items():
+            text = outputs[fmt]
+            assert len(decode(text)['items']) == count
+            best = min(timeit.repeat(lambda: decode(text), number=1,
+                                     repeat=repeat))
+            print(f"  {name:<20} {best * 1000:10.1f} ms"
+                  f"  ({len(text) // 1024} KiB)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=2000,
+                        help='number of objects in each listing')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of timing runs, the best is reported')
+    args = parser.parse_args()
+    benchmark(args.count, args.repeat)
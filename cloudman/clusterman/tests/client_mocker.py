@@ -21,7 +21,7 @@ class KubeMocker(object):
           'clusterman.clients.kube_client.KubeClient._check_environment',
           return_value=True)]
 
-    def run_command(self, command):
+    def run_command(self, command, input=None):
         return self.mock_kubectl.run_command(command)
 
 
@@ -40,11 +40,19 @@ class ClientMocker(object):
                             self.mock_run_command)
         self.patch1.start()
         testcase.addCleanup(self.patch1.stop)
+        self.patch2 = patch('clusterman.clients.helpers.stream_command',
+                            self.mock_stream_command)
+        self.patch2.start()
+        testcase.addCleanup(self.patch2.stop)
         for each in self.extra_patches:
             each.start()
             testcase.addCleanup(each.stop)
 
-    def mock_run_command(self, command, shell=False):
+    def mock_run_command(self, command, shell=False, stderr=None, input=None):
         for mocker in self.mockers:
             if mocker.can_parse(command):
-                return mocker.run_command(command)
+                return mocker.run_command(command, input=input)
+
+    def mock_stream_command(self, command):
+        output = self.mock_run_command(command)
+        yield from (output or "").splitlines(keepends=True)
@@ -1,6 +1,7 @@
 import argparse
 import copy
 import csv
+import json
 import yaml
 
 from io import StringIO
@@ -131,11 +132,19 @@ class MockKubeCtl(object):
         # kubectl get namespaces
         parser_list_ns = subparsers_get.add_parser(
             'namespaces', help='List namespaces')
+        parser_list_ns.add_argument('name', type=str, nargs='?', default=None)
+        parser_list_ns.add_argument('--ignore-not-found', action='store_true')
         parser_list_ns.set_defaults(func=self._kubectl_get_namespaces)
         # kubectl get nodes
         parser_list_nodes = subparsers_get.add_parser(
             'nodes', help='List Nodes')
-        parser_list_nodes.add_argument('-o', choices=['yaml'], default="yaml")
+        parser_list_nodes.add_argument(
+            '-o', choices=['yaml', 'json'], default="yaml")
+        parser_list_nodes.add_argument('-l', '--selector', type=str)
+        parser_list_nodes.add_argument('--watch', action='store_true')
+        parser_list_nodes.add_argument(
+            '--output-watch-events', action='store_true')
+        parser_list_nodes.add_argument('--request-timeout', type=str)
         parser_list_nodes.set_defaults(func=self._kubectl_get_nodes)
         # kubectl get pods
         parser_list_pods = subparsers_get.add_parser(
@@ -146,12 +155,18 @@ class MockKubeCtl(object):
             '--selector', type=str)
         parser_list_pods.add_argument(
             '--field-selector', type=str)
-        parser_list_pods.add_argument('-o', choices=['yaml'], default="yaml")
+        parser_list_pods.add_argument(
+            '-o', choices=['yaml', 'json'], default="yaml")
+        parser_list_pods.add_argument('--watch', action='store_true')
+        parser_list_pods.add_argument(
+            '--output-watch-events', action='store_true')
+        parser_list_pods.add_argument('--request-timeout', type=str)
         parser_list_pods.set_defaults(func=self._kubectl_get_pods)
         # kubectl get secrets
         parser_list_secrets = subparsers_get.add_parser(
             'secrets', help='List secrets')
-        parser_list_secrets.add_argument('-o', choices=['yaml'], default="yaml")
+        parser_list_secrets.add_argument(
+            '-o', choices=['yaml', 'json'], default="yaml")
         parser_list_secrets.add_argument('-n', "--namespace", default=None)
         parser_list_secrets.add_argument('name', default=None)
         parser_list_secrets.set_defaults(func=self._kubectl_get_secrets)
@@ -187,21 +202,10 @@ class MockKubeCtl(object):
         # kubectl cordon
         parser_cordon = subparsers.add_parser('cordon', help='cordon node')
         parser_cordon.add_argument(
-            'node_name', type=str, help='node to cordon')
+            'node_names', type=str, nargs='*', help='nodes to cordon')
+        parser_cordon.add_argument('-l', '--selector', type=str)
         parser_cordon.set_defaults(func=self._kubectl_cordon)
 
-        class KeyValue(argparse.Action):
-            # Constructor calling
-            def __call__(self, parser, namespace,
-                         values, option_string=None):
-                setattr(namespace, self.dest, dict())
-
-                for value in values:
-                    # split it into key and value
-                    key, value = value.split('=')
-                    # assign into dictionary
-                    getattr(namespace, self.dest)[key] = value
-
         # kubectl label
         parser_label = subparsers.add_parser('label', help='label')
         subparsers_label = parser_label.add_subparsers(
@@ -210,10 +214,10 @@ class MockKubeCtl(object):
         parser_label_node = subparsers_label.add_parser('nodes',
                                                         help='label a node')
         parser_label_node.add_argument(
-            'name', type=str, help='name of node to label')
-        parser_label_node.add_argument(
-            'labels', type=str, metavar="KEY=VALUE", nargs='+',
-            help='labels to apply', action=KeyValue)
+            'names_and_labels', type=str, nargs='+',
+            metavar="NAME... KEY=VALUE...",
+            help='names of nodes to label, followed by the labels to apply')
+        parser_label_node.add_argument('-l', '--selector', type=str)
         parser_label_node.set_defaults(func=self._kubectl_label_node)
 
         def str2bool(v):
@@ -245,14 +249,29 @@ class MockKubeCtl(object):
         args = self.parser.parse_args(command[1:])
         return args.func(args)
 
+    @staticmethod
+    def _format_output(response, output_format):
+        if output_format == "json":
+            return json.dumps(response, indent=4)
+        with StringIO() as output:
+            yaml.dump(response, stream=output, default_flow_style=False)
+            return output.getvalue()
+
     def _kubectl_get_namespaces(self, args):
         # pretend to succeed
         with StringIO() as output:
             writer = csv.DictWriter(output,
                                     fieldnames=self.namespace_list_field_names,
                                     delimiter=" ", extrasaction='ignore')
+            if args.name and args.name not in self.namespace_database:
+                if args.ignore_not_found:
+                    return ""
+                return (f'Error from server (NotFound): namespaces'
+                        f' "{args.name}" not found')
             writer.writeheader()
             for release in self.namespace_database.values():
+                if args.name and release.get('NAME') != args.name:
+                    continue
                 # Write data about the latest revision for each chart
                 writer.writerow(release)
             return output.getvalue()
@@ -274,14 +293,27 @@ class MockKubeCtl(object):
             return 'Error: namespace: "%s" not found' % name
         self.namespace_database.pop(name, None)
 
+    @staticmethod
+    def _match_selector(obj, selector):
+        if not selector:
+            return True
+        labels = obj.get('metadata', {}).get('labels', {})
+        for term in selector.split(","):
+            key, _, value = term.partition("=")
+            if labels.get(key) != value:
+                return False
+        return True
+
     def _kubectl_get_nodes(self, args):
         # get a copy of the response template
+        nodes = [node for node in self.nodes
+                 if self._match_selector(node, args.selector)]
+        if args.watch:
+            return self._watch_events('ADDED', nodes)
         response = dict(self.list_template)
         # add node to template
-        response['items'] = self.nodes
-        with StringIO() as output:
-            yaml.dump(response, stream=output, default_flow_style=False)
-            return output.getvalue()
+        response['items'] = nodes
+        return self._format_output(response, args.o)
 
     # this function only exists to help with tests.
     # it adds a new node to the cluster
@@ -294,7 +326,15 @@ class MockKubeCtl(object):
                 return self.nodes.remove(node)
         return f'Error from server (NotFound): nodes "{args.name}" not found'
 
+    @staticmethod
+    def _watch_events(event_type, objects):
+        return "".join(json.dumps({'type': event_type, 'object': obj},
+                                  indent=4) + "\n" for obj in objects)
+
     def _kubectl_get_pods(self, args):
+        if args.watch:
+            # pretend that all job pods have completed
+            return self._watch_events('DELETED', self.pods)
         # get a copy of the response template
         response = dict(self.list_template)
         self.request_counter += 1
@@ -303,13 +343,17 @@ class MockKubeCtl(object):
             response['items'] = []
         else:
             response['items'] = self.pods
-        with StringIO() as output:
-            yaml.dump(response, stream=output, default_flow_style=False)
-            return output.getvalue()
+        return self._format_output(response, args.o)
+
+    def _select_nodes(self, names, selector):
+        return [node for node in self.nodes
+                if (node['metadata']['name'] in names if not selector
+                    else self._match_selector(node, selector))]
 
     def _kubectl_cordon(self, args):
         with StringIO() as output:
-            output.write(f"node/{args.node_name} cordoned")
+            for node in self._select_nodes(args.node_names, args.selector):
+                output.write(f"node/{node['metadata']['name']} cordoned\n")
             return output.getvalue()
 
     def _kubectl_drain(self, args):
@@ -330,12 +374,14 @@ class MockKubeCtl(object):
             response = dict(self.list_template)
             # add node to template
             response['items'] = self.secrets
-        with StringIO() as output:
-            yaml.dump(response, stream=output, default_flow_style=False)
-            return output.getvalue()
+        return self._format_output(response, args.o)
 
     def _kubectl_label_node(self, args):
-        for node in self.nodes:
-            if node.get('metadata', {}).get('name') == args.name:
-                node['metadata']['labels'].update(args.labels)
-                return
+        names = [arg for arg in args.names_and_labels if "=" not in arg]
+        labels = dict(arg.split("=", 1) for arg in args.names_and_labels
+                      if "=" in arg)
+        with StringIO() as output:
+            for node in self._select_nodes(names, args.selector):
+                node['metadata']['labels'].update(labels)
+                output.write(f"node/{node['metadata']['name']} labeled\n")
+            return output.getvalue()
@@ -0,0 +1,229 @@
+import asyncio
+import functools
+import time
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from clusterman.clients import command_cache
+from clusterman.clients import helpers
+from clusterman.clients import instrumentation
+from clusterman.exceptions import CMCommandTimeoutException
+from clusterman.exceptions import CMRunCommandException
+
+
+class AsyncCommandRunnerTests(TestCase):
+
+    def test_run_all_preserves_order(self):
+        with helpers.AsyncCommandRunner(max_concurrency=4) as runner:
+            results = runner.run_all(
+                functools.partial(helpers.run_command, ["echo", str(i)])
+                for i in range(10))
+        self.assertEqual(results, [f"{i}\n" for i in range(10)])
+
+    def test_run_all_is_concurrent(self):
+        start = time.monotonic()
+        with helpers.AsyncCommandRunner(max_concurrency=4) as runner:
+            runner.run_all(
+                functools.partial(helpers.run_command, ["sleep", "0.5"])
+                for _ in range(4))
+        self.assertLess(time.monotonic() - start, 1.5)
+
+    def test_run_all_return_exceptions(self):
+        with helpers.AsyncCommandRunner() as runner:
+            results = runner.run_all(
+                [functools.partial(helpers.run_command, ["false"]),
+                 functools.partial(helpers.run_command, ["echo", "ok"])],
+                return_exceptions=True)
+        self.assertIsInstance(results[0], CMRunCommandException)
+        self.assertEqual(results[1], "ok\n")
+
+    def test_timeout_kills_command(self):
+        start = time.monotonic()
+        with helpers.AsyncCommandRunner(timeout=0.5) as runner:
+            with self.assertRaises(CMCommandTimeoutException):
+                runner.run_all(
+                    [functools.partial(helpers.run_command, ["sleep", "10"])])
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_cancellation_kills_command(self):
+        runner = helpers.AsyncCommandRunner()
+
+        async def cancel_after_start():
+            task = asyncio.ensure_future(
+                runner.call(helpers.run_command, ["sleep", "10"]))
+            await asyncio.sleep(0.5)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        start = time.monotonic()
+        asyncio.run(cancel_after_start())
+        # the worker thread only finishes early if the command was killed
+        runner._executor.shutdown(wait=True)
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_service_proxy(self):
+        class Service(object):
+            name = "service"
+
+            def echo(self, text):
+                return helpers.run_command(["echo", text])
+
+        proxy = helpers.AsyncServiceProxy(Service(),
+                                          helpers.AsyncCommandRunner())
+        self.assertEqual(proxy.name, "service")
+        self.assertEqual(asyncio.run(proxy.echo("hello")), "hello\n")
+
+
+class RunCommandTests(TestCase):
+
+    def test_input_is_written_to_stdin(self):
+        self.assertEqual(helpers.run_command(["cat"], input="a: 1\n"),
+                         "a: 1\n")
+
+    def test_stream_command_timeout_kills_command(self):
+        token = helpers.command_timeout.set(0.5)
+        self.addCleanup(helpers.command_timeout.reset, token)
+        start = time.monotonic()
+        lines = []
+        with self.assertRaises(CMCommandTimeoutException):
+            for line in helpers.stream_command(
+                    ["sh", "-c", "echo started; exec sleep 10"]):
+                lines.append(line)
+        self.assertEqual(lines, ["started\n"])
+        self.assertLess(time.monotonic() - start, 5)
+
+
+class CommandCacheTests(TestCase):
+
+    def test_classify(self):
+        classify = command_cache.classify
+        self.assertEqual(classify(["kubectl", "get", "namespaces"]),
+                         (True, {'namespaces'}))
+        self.assertEqual(classify(
+            ["kubectl", "get", "pods", "--all-namespaces", "-o", "json"]),
+            (True, {'pods'}))
+        self.assertEqual(classify(["kubectl", "label", "nodes", "n1", "a=b"]),
+                         (False, {'nodes'}))
+        self.assertEqual(classify(["kubectl", "delete", "namespace", "ns"]),
+                         (False, command_cache.ALL_KINDS))
+        self.assertEqual(classify(["helm", "list", "--all-namespaces"]),
+                         (True, {'releases'}))
+        self.assertEqual(classify(["helm", "upgrade", "rel", "repo/chart"]),
+                         (False, {'releases', 'secrets'}))
+        self.assertEqual(classify(["helm", "repo", "update"]),
+                         (False, {'repo_charts'}))
+        self.assertEqual(classify(["echo", "hello"]), (False, set()))
+
+    @patch('clusterman.clients.helpers._run_process',
+           side_effect=lambda c, **kw: str(c))
+    def test_reads_are_cached_within_scope(self, run_process):
+        with command_cache.cached_commands() as cache:
+            helpers.run_command(["kubectl", "get", "namespaces"])
+            helpers.run_command(["kubectl", "get", "namespaces"])
+            helpers.run_command(["helm", "list", "--all-namespaces"])
+            self.assertEqual(run_process.call_count, 2)
+            self.assertEqual((cache.hits, cache.misses), (1, 2))
+        helpers.run_command(["kubectl", "get", "namespaces"])
+        self.assertEqual(run_process.call_count, 3)
+
+    @patch('clusterman.clients.helpers._run_process',
+           side_effect=lambda c, **kw: str(c))
+    def test_writes_invalidate_affected_kinds(self, run_process):
+        with command_cache.cached_commands():
+            helpers.run_command(["kubectl", "get", "namespaces"])
+            helpers.run_command(["helm", "list", "--all-namespaces"])
+            helpers.run_command(["kubectl", "create", "namespace", "new"])
+            helpers.run_command(["kubectl", "get", "namespaces"])
+            helpers.run_command(["helm", "list", "--all-namespaces"])
+            # namespaces listed twice, releases listed once, plus the create
+            self.assertEqual(run_process.call_count, 4)
+
+    @patch('clusterman.clients.helpers._run_process',
+           side_effect=lambda c, **kw: str(c))
+    def test_writes_with_input_invalidate_affected_kinds(self, run_process):
+        with command_cache.cached_commands():
+            helpers.run_command(["helm", "list", "--all-namespaces"])
+            helpers.run_command(["helm", "upgrade", "rel", "repo/chart",
+                                 "-f", "-"], input="a: 1\n")
+            helpers.run_command(["helm", "list", "--all-namespaces"])
+            self.assertEqual(run_process.call_count, 3)
+
+    @patch('clusterman.clients.helpers._run_process',
+           side_effect=lambda c, **kw: str(c))
+    def test_entries_expire(self, run_process):
+        with command_cache.cached_commands(ttl=0.1):
+            helpers.run_command(["kubectl", "get", "nodes"])
+            time.sleep(0.2)
+            helpers.run_command(["kubectl", "get", "nodes"])
+            self.assertEqual(run_process.call_count, 2)
+
+
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        instrumentation.metrics.reset()
+
+    def test_command_label(self):
+        label = instrumentation.command_label
+        self.assertEqual(label(["kubectl", "get", "nodes", "-o", "json"]),
+                         "kubectl get nodes")
+        self.assertEqual(label(["kubectl", "label", "node", "n1", "a=b"]),
+                         "kubectl label nodes")
+        self.assertEqual(label(["kubectl", "cordon", "secret-node-name"]),
+                         "kubectl cordon")
+        self.assertEqual(label(["/usr/bin/helm", "repo", "update"]),
+                         "helm repo update")
+        self.assertEqual(label(["helm", "upgrade", "my-release", "repo/chart",
+                                "--set", "password=secret"]), "helm upgrade")
+        self.assertEqual(label("kubectl get nodes | grep secret"), "shell")
+
+    def test_run_command_records_metrics(self):
+        helpers.run_command(["echo", "hello"])
+        with self.assertRaises(CMRunCommandException):
+            helpers.run_command(["false"])
+        output = instrumentation.metrics.render_prometheus()
+        self.assertIn('cloudman_command_duration_seconds_count'
+                      '{command="echo"} 1', output)
+        self.assertIn('cloudman_command_exit_total'
+                      '{command="false",exit_code="1"} 1', output)
+        self.assertIn('cloudman_command_output_bytes_total'
+                      '{command="echo"} 6', output)
+
+    def test_stream_stopped_early_is_not_a_failure(self):
+        stream = helpers.stream_command(
+            ["sh", "-c", "echo first; exec sleep 10"])
+        self.assertEqual(next(stream), "first\n")
+        stream.close()
+        output = instrumentation.metrics.render_prometheus()
+        self.assertIn('cloudman_command_exit_total'
+                      '{command="sh",exit_code="cancelled"} 1', output)
+        self.assertNotIn('exit_code="-9"', output)
+
+    def test_cancelled_process_is_not_a_failure(self):
+        processes = set()
+        token = helpers.running_processes.set(processes)
+        self.addCleanup(helpers.running_processes.reset, token)
+        stream = helpers.stream_command(
+            ["sh", "-c", "echo first; exec sleep 10"])
+        self.assertEqual(next(stream), "first\n")
+        # as when an informer is stopped
+        for process in list(processes):
+            helpers.cancel_process(process)
+        with self.assertRaises(CMRunCommandException):
+            list(stream)
+        output = instrumentation.metrics.render_prometheus()
+        self.assertIn('cloudman_command_exit_total'
+                      '{command="sh",exit_code="cancelled"} 1', output)
+
+    def test_request_summary(self):
+        summary = instrumentation.RequestSummary()
+        token = instrumentation.request_summary.set(summary)
+        try:
+            list(helpers.stream_command(["echo", "hello"]))
+            helpers.run_command(["echo", "again"])
+        finally:
+            instrumentation.request_summary.reset(token)
+        self.assertEqual(summary.totals["echo"][0], 2)
+        self.assertRegex(summary.as_header(), r"^echo=2/\d+\.\d{3}s$")
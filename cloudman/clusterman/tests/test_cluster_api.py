@@ -13,6 +13,8 @@ from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase, APILiveServerTestCase
 
+from clusterman.api import CloudManAPI
+from clusterman.api import CMServiceContext
 from clusterman.clients.kube_client import KubeClient
 from .client_mocker import ClientMocker
 
@@ -418,6 +420,52 @@ class CMClusterNodeServiceTests(CMClusterNodeTestBase):
         node_list = client.nodes.list()
         self.assertEqual(len(node_list), 2)
 
+    def _create_labelled_cluster_nodes(self, cluster_id, count):
+        for _ in range(count):
+            response = self._create_cluster_node(cluster_id)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED,
+                             response.content)
+        cmapi = CloudManAPI(CMServiceContext(
+            user=User.objects.get(username='clusteradmin')))
+        cluster = cmapi.clusters.get(cluster_id)
+        nodes = cluster.nodes.list()
+        names = {node.name for node in nodes}
+        self.assertEqual(len(names), count)
+        # label the k8s nodes as the rke plugin does when configuring them,
+        # so that they are drained by the pipeline before being released
+        kube_mocker = self.mock_client.mockers[0]
+        for k8s_node in kube_mocker.mock_kubectl.nodes:
+            name = k8s_node['metadata']['name']
+            if name in names:
+                k8s_node['metadata']['labels'][
+                    'usegalaxy.org/cm_node_name'] = name
+        return cluster, nodes
+
+    def _k8s_node_names(self):
+        return {n['metadata']['name'] for n in KubeClient().nodes.list()}
+
+    def test_celery_task_delete_many_cluster_nodes(self):
+        cluster_id = self._create_cluster()
+        cluster, nodes = self._create_labelled_cluster_nodes(cluster_id, 2)
+        names = {node.name for node in nodes}
+
+        result = cluster.nodes.delete_many(nodes)
+        self.assertEqual(result.get(), {name: None for name in names})
+
+        # the pipeline removed the k8s nodes, and each node was then
+        # released through node.delete()
+        self.assertFalse(names & self._k8s_node_names())
+        self._check_no_cluster_nodes_exist(cluster_id)
+
+    def test_delete_cluster_drains_nodes(self):
+        cluster_id = self._create_cluster()
+        _, nodes = self._create_labelled_cluster_nodes(cluster_id, 2)
+        url = reverse('clusterman:clusters-detail', args=[cluster_id])
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse({node.name for node in nodes} &
+                         self._k8s_node_names())
+
     def test_node_create_unauthorized(self):
         cluster_id = self._create_cluster()
         self.client.force_login(
@@ -1348,6 +1396,27 @@ class CMClusterScaleSignalTests(CMClusterNodeTestBase):
             [n['name'] for n
              in self._get_cluster_nodes(cluster_id)['results']])
 
+    def test_scale_down_picks_emptiest_node(self):
+        # create the parent cluster
+        cluster_id = self._create_cluster()
+
+        # send three autoscale signals
+        self._signal_scaleup(cluster_id)
+        self._signal_scaleup(cluster_id)
+        self._signal_scaleup(cluster_id)
+
+        # only the first node launched has no running jobs
+        nodes = self._get_cluster_nodes(cluster_id)['results']
+        job_counts = {nodes[0]['name']: 0, nodes[1]['name']: 2,
+                      nodes[2]['name']: 1}
+        with patch('clusterman.cluster_templates.CMRKETemplate'
+                   '.count_active_jobs', return_value=job_counts):
+            self._signal_scaledown(cluster_id)
+
+        remaining = [n['name'] for n
+                     in self._get_cluster_nodes(cluster_id)['results']]
+        self.assertEqual(remaining, [nodes[1]['name'], nodes[2]['name']])
+
     def test_scale_up_signal_target_multiple_groups(self):
         # create the parent cluster
         cluster_id = self._create_cluster()
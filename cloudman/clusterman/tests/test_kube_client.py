@@ -0,0 +1,404 @@
+import json
+import threading
+import time
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from clusterman.clients import kube_informer
+from clusterman.clients.kube_drain import KubeNodeDrainPipeline
+from clusterman.clients.kube_client import KubeNamespaceService
+from clusterman.clients.kube_client import KubeNodeIndex
+from clusterman.clients.kube_client import KubeNodeService
+from clusterman.clients.kube_client import RUNNING_JOB_PODS
+from clusterman.clients.kube_client import label_selector
+from clusterman.exceptions import CMRunCommandException
+
+from .client_mocker import ClientMocker
+from .mock_kubectl import MockKubeCtl
+
+
+def _node(name, version, labels=None):
+    return {
+        "kind": "Node",
+        "metadata": {
+            "name": name,
+            "resourceVersion": str(version),
+            "labels": labels or {}
+        }
+    }
+
+
+class KubeInformerTests(TestCase):
+
+    def setUp(self):
+        self.informer = kube_informer.KubeInformer("nodes")
+        listing = {"kind": "List", "metadata": {"resourceVersion": "10"},
+                   "items": [_node("node1", 5), _node("node2", 6)]}
+        with patch('clusterman.clients.helpers.run_command',
+                   return_value=json.dumps(listing)):
+            self.informer._relist()
+
+    def test_relist_populates_store(self):
+        self.assertTrue(self.informer.has_synced())
+        self.assertEqual(self.informer.resource_version, "10")
+        self.assertEqual(
+            sorted(n['metadata']['name'] for n in self.informer.list()),
+            ["node1", "node2"])
+
+    def test_watch_events_update_store(self):
+        events = [
+            {"type": "ADDED", "object": _node("node3", 11)},
+            {"type": "MODIFIED", "object": _node("node1", 12, {"a": "b"})},
+            {"type": "DELETED", "object": _node("node2", 13)},
+        ]
+        stream = "".join(json.dumps(e, indent=4) + "\n" for e in events)
+        with patch('clusterman.clients.helpers.stream_command',
+                   return_value=iter(stream.splitlines(keepends=True))):
+            self.informer._watch()
+        self.assertEqual(self.informer.resource_version, "13")
+        self.assertIsNone(self.informer.get("node2"))
+        self.assertEqual(self.informer.get("node1")['metadata']['labels'],
+                         {"a": "b"})
+        self.assertIsNotNone(self.informer.get("node3"))
+
+    def test_watch_removes_objects_it_did_not_mention(self):
+        # a new watch replays the current state of every object first
+        stream = json.dumps({"type": "ADDED", "object": _node("node1", 5)},
+                            indent=4) + "\n"
+        with patch('clusterman.clients.helpers.stream_command',
+                   return_value=iter(stream.splitlines(keepends=True))):
+            self.informer._watch()
+        self.assertIsNotNone(self.informer.get("node1"))
+        self.assertIsNone(self.informer.get("node2"))
+
+    def test_objects_missing_from_replay_are_removed_at_first_change(self):
+        seen = []
+        events = [
+            {"type": "ADDED", "object": _node("node1", 5)},
+            {"type": "MODIFIED", "object": _node("node1", 14, {"a": "b"})},
+            {"type": "ADDED", "object": _node("node3", 15)},
+        ]
+
+        def stream(command):
+            for event in events:
+                yield from (json.dumps(event, indent=4) + "\n").splitlines(
+                    keepends=True)
+                seen.append(self.informer.get("node2"))
+
+        with patch('clusterman.clients.helpers.stream_command',
+                   side_effect=stream):
+            self.informer._watch()
+        # node2 was removed as soon as the replay was over, rather than
+        # when the stream ended
+        self.assertIsNotNone(seen[0])
+        self.assertEqual(seen[1:], [None, None])
+        self.assertIsNotNone(self.informer.get("node3"))
+
+    def test_stale_events_are_ignored(self):
+        version = self.informer.version
+        self.informer._apply_event(
+            {"type": "MODIFIED", "object": _node("node1", 4, {"a": "b"})})
+        self.assertEqual(self.informer.get("node1")['metadata']['labels'], {})
+        self.assertEqual(self.informer.version, version)
+
+    def test_node_service_reads_from_informer(self):
+        node_svc = KubeNodeService(None, informer=self.informer)
+        with patch('clusterman.clients.helpers.run_command') as run_command:
+            nodes = node_svc.list()
+            run_command.assert_not_called()
+        self.assertEqual(len(nodes), 2)
+
+    def test_stop_during_relist_does_not_start_watch(self):
+        informer = kube_informer.KubeInformer("nodes")
+
+        def relist():
+            informer.stop()
+
+        with patch.object(informer, '_relist', side_effect=relist), \
+                patch.object(informer, '_watch') as watch:
+            informer._run()
+        watch.assert_not_called()
+
+    def test_process_started_after_stop_is_killed(self):
+        informer = kube_informer.KubeInformer("nodes")
+        informer.stop()
+        process = Mock()
+        informer._processes.add(process)
+        process.kill.assert_called_once_with()
+        self.assertTrue(process.cancelled)
+
+    def test_iter_json_objects_pretty_printed(self):
+        nodes = MockKubeCtl().nodes * 3
+        stream = "".join(json.dumps(n, indent=4) + "\n" for n in nodes)
+        decoded = list(kube_informer.iter_json_objects(
+            stream.splitlines(keepends=True)))
+        self.assertEqual(decoded, nodes)
+
+
+class JobCompletionTests(TestCase):
+
+    def setUp(self):
+        self.mock_client = ClientMocker(self)
+        self.node = {'metadata': {'name': 'ip-10-0-24-156.ec2.internal'}}
+
+    def test_count_job_pods_by_node(self):
+        with patch('clusterman.clients.helpers.run_command',
+                   wraps=self.mock_client.mock_run_command) as run_command:
+            counts = KubeNodeService(None).count_job_pods_by_node()
+            self.assertEqual(run_command.call_count, 1)
+        self.assertEqual(counts, {'ip-10-0-24-156.ec2.internal': 1})
+
+    def test_concurrent_waits_share_watch(self):
+        key = (kube_informer.os.getpid(),) + RUNNING_JOB_PODS
+        with kube_informer.shared_informer(*RUNNING_JOB_PODS) as first:
+            with kube_informer.shared_informer(*RUNNING_JOB_PODS) as second:
+                self.assertIs(first, second)
+                self.assertEqual(kube_informer._informer_users[key], 2)
+            self.assertFalse(first._stopped.is_set())
+        self.assertTrue(first._stopped.is_set())
+        # let the watch end before the kubectl mock is removed
+        first._thread.join(5)
+        self.assertFalse(first.is_running)
+
+    def test_wait_returns_when_jobs_complete(self):
+        node_svc = KubeNodeService(None)
+        waiters = [threading.Thread(target=node_svc.wait_till_jobs_complete,
+                                    args=(self.node,), kwargs={'timeout': 10})
+                   for _ in range(3)]
+        start = time.monotonic()
+        for waiter in waiters:
+            waiter.start()
+        for waiter in waiters:
+            waiter.join(10)
+            self.assertFalse(waiter.is_alive())
+        # polling would have taken at least one 5 second interval
+        self.assertLess(time.monotonic() - start, 4)
+
+
+class FakeNodeService(object):
+
+    def __init__(self, fail=None):
+        self.fail = fail or set()
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def cordon_many(self, nodes):
+        return {node['metadata']['name']: "cordoned" for node in nodes}
+
+    def wait_till_jobs_complete(self, node):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.1)
+        with self.lock:
+            self.active -= 1
+        if node['metadata']['name'] in self.fail:
+            raise CMRunCommandException("jobs did not complete")
+
+    def drain(self, node, timeout=None):
+        pass
+
+    def delete(self, node):
+        pass
+
+
+class KubeNodeDrainPipelineTests(TestCase):
+
+    def setUp(self):
+        self.nodes = [_node(f"node{i}", i) for i in range(6)]
+        self.node_svc = FakeNodeService(fail={"node2"})
+        self.kube_client = type("FakeKubeClient", (), {})()
+        self.kube_client.nodes = self.node_svc
+        self.progress = []
+        self.released = []
+
+    def _run(self, max_parallel):
+        pipeline = KubeNodeDrainPipeline(
+            kube_client=self.kube_client, max_parallel=max_parallel,
+            release=lambda node: self.released.append(node['metadata']['name']),
+            progress=lambda name, stage: self.progress.append((name, stage)))
+        return pipeline.run(self.nodes)
+
+    def test_all_nodes_cordoned_before_removal(self):
+        self._run(max_parallel=2)
+        stages = [stage for _, stage in self.progress]
+        self.assertEqual(stages[:6], ['cordoned'] * 6)
+
+    def test_parallelism_is_bounded(self):
+        self._run(max_parallel=2)
+        self.assertEqual(self.node_svc.max_active, 2)
+
+    def test_failed_nodes_are_still_released(self):
+        errors = self._run(max_parallel=3)
+        self.assertIsInstance(errors.pop("node2"), CMRunCommandException)
+        self.assertEqual(set(errors.values()), {None})
+        self.assertEqual(sorted(self.released),
+                         [f"node{i}" for i in range(6)])
+        node2 = [stage for name, stage in self.progress if name == "node2"]
+        self.assertEqual(node2, ['cordoned', 'deleted', 'released', 'failed'])
+        node1 = [stage for name, stage in self.progress if name == "node1"]
+        self.assertEqual(node1, ['cordoned', 'jobs_complete', 'drained',
+                                 'deleted', 'released'])
+
+    def test_cleanup_follows_last_report_in_worker(self):
+        events = []
+
+        def progress(name, stage):
+            events.append((threading.get_ident(), name, stage))
+
+        def cleanup():
+            events.append((threading.get_ident(), None, 'cleanup'))
+
+        KubeNodeDrainPipeline(
+            kube_client=self.kube_client, max_parallel=3,
+            progress=progress, cleanup=cleanup).run(self.nodes)
+        # in each worker thread, a node's reports end before its cleanup
+        by_thread = {}
+        for thread, _, stage in events:
+            if stage != 'cordoned':
+                by_thread.setdefault(thread, []).append(stage)
+        removals = []
+        for stages in by_thread.values():
+            self.assertEqual(stages[-1], 'cleanup')
+            removals += " ".join(stages).split(" cleanup")[:-1]
+        self.assertEqual(len(removals), 6)
+        for removal in removals:
+            self.assertIn(removal.split()[-1], ('deleted', 'failed'))
+
+
+class BulkNodeCommandTests(TestCase):
+
+    def setUp(self):
+        self.mock_client = ClientMocker(self)
+        self.kubectl = self.mock_client.mockers[0].mock_kubectl
+        self.node_svc = KubeNodeService(None)
+        self.nodes = self.node_svc.list()
+
+    def test_cordon_many(self):
+        with patch('clusterman.clients.helpers.run_command',
+                   wraps=self.mock_client.mock_run_command) as run_command:
+            results = self.node_svc.cordon_many(self.nodes)
+            self.assertEqual(run_command.call_count, 1)
+        self.assertEqual(
+            results, {n['metadata']['name']: "cordoned" for n in self.nodes})
+
+    def test_set_label_many_by_selector(self):
+        name = self.nodes[0]['metadata']['name']
+        results = self.node_svc.set_label_many(
+            {"usegalaxy.org/cm_node_name": "n1"},
+            selector=f"kubernetes.io/hostname={name}")
+        self.assertEqual(results, {name: "labeled"})
+        self.assertEqual(
+            [n['metadata']['name'] for n in self.node_svc.find(
+                labels={"usegalaxy.org/cm_node_name": "n1"})],
+            [name])
+
+    def test_partial_failure(self):
+        output = ('Error running command: node/node1 cordoned\n'
+                  'Error from server (NotFound): nodes "node2" not found\n')
+        with patch('clusterman.clients.helpers.run_command',
+                   side_effect=CMRunCommandException(output)):
+            results = self.node_svc.cordon_many(
+                [_node("node1", 1), _node("node2", 2)])
+        self.assertEqual(results["node1"], "cordoned")
+        self.assertIsInstance(results["node2"], CMRunCommandException)
+
+
+class KubeNamespaceServiceTests(TestCase):
+
+    def setUp(self):
+        self.mock_client = ClientMocker(self)
+
+    def test_get_namespace(self):
+        namespaces = KubeNamespaceService(None)
+        self.assertEqual(namespaces.get("default").get('NAME'), "default")
+        self.assertIsNone(namespaces.get("missing"))
+
+    def test_get_namespace_error(self):
+        with patch('clusterman.clients.helpers.run_command',
+                   side_effect=CMRunCommandException("connection refused")):
+            with self.assertRaises(CMRunCommandException):
+                KubeNamespaceService(None).get("default")
+
+
+class KubeNodeIndexTests(TestCase):
+
+    def setUp(self):
+        self.nodes = [
+            _node("node1", 1, {"usegalaxy.org/cm_node_name": "n1",
+                               "usegalaxy.org/cm_autoscaling_group": "g1"}),
+            _node("node2", 2, {"usegalaxy.org/cm_node_name": "n2",
+                               "usegalaxy.org/cm_autoscaling_group": "g1"}),
+            _node("node3", 3, {"usegalaxy.org/cm_node_name": "n3"}),
+        ]
+        for i, node in enumerate(self.nodes):
+            node['status'] = {'addresses': [
+                {'address': f"10.0.0.{i}", 'type': 'InternalIP'},
+                {'address': None, 'type': 'ExternalIP'}]}
+        self.index = KubeNodeIndex(self.nodes)
+
+    def test_find_by_label(self):
+        self.assertEqual(
+            self.index.find(labels={"usegalaxy.org/cm_node_name": "n2"}),
+            [self.nodes[1]])
+        self.assertEqual(
+            self.index.find(
+                labels={"usegalaxy.org/cm_autoscaling_group": "g1"}),
+            self.nodes[:2])
+        self.assertEqual(
+            self.index.find(labels={
+                "usegalaxy.org/cm_node_name": "n3",
+                "usegalaxy.org/cm_autoscaling_group": "g1"}),
+            [])
+
+    def test_find_by_address(self):
+        self.assertEqual(self.index.find(address="10.0.0.2"), [self.nodes[2]])
+        self.assertEqual(self.index.find(address="10.0.0.9"), [])
+        self.assertEqual(
+            self.index.find(address="10.0.0.0",
+                            labels={"usegalaxy.org/cm_node_name": "n1"}),
+            [self.nodes[0]])
+
+    def test_find_without_criteria(self):
+        self.assertEqual(self.index.find(), self.nodes)
+        self.assertEqual(self.index.find(labels={"min_vcpus": [1]}), [])
+
+    def test_informer_index_rebuilt_on_change(self):
+        informer = kube_informer.KubeInformer("nodes")
+        informer._apply_event({"type": "ADDED", "object": self.nodes[0]})
+        index = informer.index(KubeNodeIndex)
+        self.assertIs(index, informer.index(KubeNodeIndex))
+        informer._apply_event({"type": "ADDED", "object": self.nodes[1]})
+        self.assertIsNot(index, informer.index(KubeNodeIndex))
+        self.assertEqual(len(informer.index(KubeNodeIndex).find()), 2)
+
+
+class LabelSelectorTests(TestCase):
+
+    def test_label_selector(self):
+        self.assertEqual(
+            label_selector({"usegalaxy.org/cm_node_name": "cluster-abc123",
+                            "node-role.kubernetes.io/master": ""}),
+            "usegalaxy.org/cm_node_name=cluster-abc123,"
+            "node-role.kubernetes.io/master=")
+
+    def test_inexpressible_labels(self):
+        self.assertIsNone(label_selector({"min_vcpus": 2}))
+        self.assertIsNone(label_selector({"key": "has spaces"}))
+        self.assertIsNone(label_selector({"Not.A.Prefix/key": "value"}))
+        self.assertIsNone(label_selector({"key": "a" * 64}))
+
+    def test_find_uses_selector(self):
+        mock_kubectl = MockKubeCtl()
+        with patch('clusterman.clients.helpers.run_command',
+                   side_effect=mock_kubectl.run_command) as run_command:
+            node_svc = KubeNodeService(None)
+            nodes = node_svc.find(
+                labels={"kubernetes.io/hostname": "docker-desktop"})
+            self.assertEqual(len(nodes), 1)
+            self.assertIn("kubernetes.io/hostname=docker-desktop",
+                          run_command.call_args[0][0])
+            self.assertEqual(node_svc.find(labels={"min_vcpus": 2}), [])
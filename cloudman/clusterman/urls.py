@@ -28,6 +28,8 @@ app_name = "clusterman"
 
 cluster_regex_pattern = r'^'
 urlpatterns = [
+    re_path(r'^metrics/$', views.CommandMetricsView.as_view(),
+            name='metrics'),
     re_path(r'^', include(router.urls)),
     re_path(cluster_regex_pattern, include(cluster_router.urls))
 ]
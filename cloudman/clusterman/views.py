@@ -1,14 +1,20 @@
 """CloudMan Create views."""
+import json
+
 from django.contrib.auth.models import User
 
 from rest_framework.authentication import SessionAuthentication, BasicAuthentication
 from rest_framework.permissions import IsAuthenticated
+from rest_framework import renderers
 from rest_framework import viewsets, mixins
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
 from djcloudbridge import drf_helpers
 from . import serializers
 from .api import CloudManAPI
 from .api import CMServiceContext
+from .clients.instrumentation import metrics
 from .models import GlobalSettings
 
 
@@ -203,3 +209,27 @@ class ClusterScaleDownSignalViewSet(CustomCreateOnlyModelViewSet):
         # dispatch scale down signal for each alert
         for alert in alerts_per_group.values():
             self._process_alert(alert)
+
+
+class PrometheusTextRenderer(renderers.BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # errors, such as authentication failures, are returned as dicts
+        return data if isinstance(data, str) else json.dumps(data)
+
+
+class CommandMetricsView(APIView):
+    """
+    Returns timings, exit codes and output sizes of the kubectl and helm
+    commands run by this process, in the Prometheus text format.
+    """
+    renderer_classes = (PrometheusTextRenderer,)
+    permission_classes = (IsAuthenticated,)
+    authentication_classes = [SessionAuthentication, BasicAuthentication]
+
+    def get(self, request, format=None):
+        return Response(metrics.render_prometheus(),
+                        content_type='text/plain; version=0.0.4')
@@ -1,10 +1,9 @@
 """HelmsMan Service API."""
-import jinja2
-import yaml
+import contextlib
+import functools
 
-from ansible.plugins.filter import ipaddr
+import yaml
 
-from django.apps import apps
 from django.conf import settings
 from django.db import IntegrityError
 from django.db import transaction
@@ -13,12 +12,16 @@ from django.contrib.auth.models import User
 
 from rest_framework.exceptions import PermissionDenied
 
+from clusterman.clients.helpers import AsyncCommandRunner
 from clusterman.clients.kube_client import KubeClient
 
+from . import helpers as hm_helpers
 from . import models
+from . import templating
 
 from .clients.helm_client import HelmClient
 from .clients.helm_client import HelmValueHandling
+from .clients.helm_storage import HelmReleaseStorage
 
 
 class HelmsmanException(Exception):
@@ -49,6 +52,10 @@ class InstallTemplateNotFoundException(HelmsmanException):
     pass
 
 
+class InvalidInstallTemplateContextException(HelmsmanException):
+    pass
+
+
 class HMServiceContext(object):
     """
     A class to contain contextual information when processing a
@@ -138,8 +145,11 @@ class HMNamespaceService(HelmsManService):
                 if self.has_permissions('helmsman.view_namespace', namespace)]
 
     def get(self, namespace):
-        namespaces = (n for n in self.list() if n.name == namespace)
-        ns = next(namespaces, None)
+        # Repeated lookups within a request or task are served from the
+        # command cache, which is invalidated when namespaces change
+        n = KubeClient().namespaces.get(namespace)
+        ns = (KubeNamespace(self, **n) if n and
+              self.has_permissions('helmsman.view_namespace', n) else None)
         self.check_permissions('helmsman.view_chart', ns)
         return ns
 
@@ -188,32 +198,78 @@ class HMChartService(HelmsManService):
     def __init__(self, context):
         super(HMChartService, self).__init__(context)
 
-    def list(self, namespace=None):
+    def _to_chart(self, client, release, values=None, templates=None):
+        # Unless they are supplied, values are only fetched from helm when
+        # the chart's values are first accessed
+        chart_name = client.releases.parse_chart_name(release.get('CHART'))
+        if templates is None:
+            install_template = self._find_closest_install_template(chart_name)
+        else:
+            install_template = templates.get(chart_name)
+        values_loader = functools.partial(
+            client.releases.get_values, release.get("NAMESPACE"),
+            release.get("NAME"), get_all=True)
+        return HelmChart(
+            self,
+            id=release.get('NAME'),
+            name=chart_name,
+            namespace=release.get("NAMESPACE"),
+            chart_version=client.releases.parse_chart_version(
+                release.get('CHART')),
+            revision=release.get("REVISION"),
+            app_version=release.get("APP VERSION"),
+            state=release.get("STATUS"),
+            updated=release.get("UPDATED"),
+            values=values,
+            values_loader=values_loader,
+            install_template=install_template
+        )
+
+    def list(self, namespace=None, with_values=True):
+        """
+        Lists installed charts. If with_values is False, the values of each
+        chart are not fetched up front, but are loaded from helm when first
+        accessed. This is much faster when only the names or states of
+        charts are needed.
+        """
         client = HelmClient()
+        # Load all install templates at once, rather than once per release
+        templates = HelmsManAPI(self.context).templates.find_by_chart()
+        if settings.HELMSMAN_USE_HELM_STORAGE:
+            # releases and their values are all decoded from a single call
+            charts = (self._to_chart(client, release, values or {},
+                                     templates=templates)
+                      for release, values in
+                      HelmReleaseStorage().list_with_values(namespace))
+            return [c for c in charts
+                    if self.has_permissions('helmsman.view_chart', c)]
         releases = client.releases.list(namespace)
-        charts = (
-            HelmChart(
-                self,
-                id=release.get('NAME'),
-                name=client.releases.parse_chart_name(release.get('CHART')),
-                namespace=release.get("NAMESPACE"),
-                chart_version=client.releases.parse_chart_version(release.get('CHART')),
-                revision=release.get("REVISION"),
-                app_version=release.get("APP VERSION"),
-                state=release.get("STATUS"),
-                updated=release.get("UPDATED"),
-                values=HelmClient().releases.get_values(
-                    release.get("NAMESPACE"), release.get("NAME"), get_all=True),
-                install_template=self._find_closest_install_template(
-                    client.releases.parse_chart_name(release.get('CHART')))
-            )
-            for release in releases
-        )
+        if not with_values:
+            charts = (self._to_chart(client, release, templates=templates)
+                      for release in releases)
+            return [c for c in charts
+                    if self.has_permissions('helmsman.view_chart', c)]
+        # Fetch the values of all releases concurrently
+        with AsyncCommandRunner(
+                max_concurrency=settings.HELMSMAN_MAX_CONCURRENCY) as runner:
+            values = runner.run_all(
+                functools.partial(client.releases.get_values,
+                                  release.get("NAMESPACE"),
+                                  release.get("NAME"), get_all=True)
+                for release in releases)
+        charts = (self._to_chart(client, release, release_values or {},
+                                 templates=templates)
+                  for release, release_values in zip(releases, values))
         return [c for c in charts if self.has_permissions('helmsman.view_chart', c)]
 
-    def get(self, chart_id):
-        charts = (c for c in self.list() if c.id == chart_id)
-        chart = next(charts, None)
+    def get(self, chart_id, namespace=None):
+        """
+        Returns the chart installed as the release named chart_id, searching
+        all namespaces unless a namespace is given.
+        """
+        client = HelmClient()
+        release = client.releases.get(namespace, chart_id)
+        chart = self._to_chart(client, release) if release else None
         self.check_permissions('helmsman.view_chart', chart)
         return chart
 
@@ -222,11 +278,7 @@ class HMChartService(HelmsManService):
         return client.templates.find(chart_name=chart_name)
 
     def _get_from_namespace(self, namespace, chart_name):
-        matches = [c for c in self.list(namespace) if c.name == chart_name]
-        if matches:
-            return matches[0]
-        else:
-            return None
+        return self.find(namespace, chart_name)
 
     def _find_repo_for_chart(self, chart):
         # We use a best guess because helm does not track which repository a chart
@@ -241,11 +293,17 @@ class HMChartService(HelmsManService):
             return None
 
     def find(self, namespace, chart_name):
-        existing_chart = [
-            c for c in self.list(namespace=namespace)
-            if c.name == chart_name
-        ]
-        return existing_chart[0] if existing_chart else None
+        # Stream releases so that we can stop at the first match, and only
+        # build a chart for matching releases.
+        client = HelmClient()
+        with contextlib.closing(client.releases.stream(namespace)) as releases:
+            for release in releases:
+                if client.releases.parse_chart_name(
+                        release.get('CHART')) == chart_name:
+                    chart = self._to_chart(client, release)
+                    if self.has_permissions('helmsman.view_chart', chart):
+                        return chart
+        return None
 
     def create(self, repo_name, chart_name, namespace,
                release_name=None, version=None, values=None):
@@ -256,32 +314,69 @@ class HMChartService(HelmsManService):
             raise ChartExistsException(
                 f"Chart {repo_name}/{chart_name} already installed in namespace {namespace}.")
         else:
-            client.repositories.update()
+            client.repositories.ensure_fresh(
+                repo_name, max_age=settings.HELMSMAN_REPO_MAX_AGE)
             client.releases.create(f"{repo_name}/{chart_name}", namespace,
                                    release_name=release_name, version=version,
                                    values=values)
         return self._get_from_namespace(namespace, chart_name)
 
-    def update(self, chart, values, version=None, reset_values=None):
+    def _is_noop_update(self, client, chart, repo_name, values, version,
+                        reset_values):
+        """
+        Whether upgrading the chart would leave it unchanged, that is, the
+        chart version and the values helm would compute for the new revision
+        have the same fingerprint as those of the deployed revision.
+        """
+        if (chart.state or "").lower() != "deployed":
+            return False
+        if not version:
+            # helm upgrades to the latest version in the repository
+            latest = [c for c in client.repo_charts.find(chart.name, None)
+                      if c.get('NAME') == f"{repo_name}/{chart.name}"]
+            version = latest[0].get('CHART VERSION') if latest else None
+        if version != chart.chart_version:
+            return False
+        current = client.releases.get_values(
+            chart.namespace, chart.id, get_all=False) or {}
+        new = hm_helpers.merge_values(
+            *(values if isinstance(values, list) else [values]))
+        if not reset_values:
+            new = hm_helpers.merge_values(current, new)
+        return (hm_helpers.values_fingerprint(version, new) ==
+                hm_helpers.values_fingerprint(chart.chart_version, current))
+
+    def update(self, chart, values, version=None, reset_values=None,
+               force=False):
+        """
+        Upgrades the chart with the given values. Unless force is set, the
+        upgrade is skipped if it would not change the chart version or
+        values, so that no new revision is created and no pods restart.
+        """
         self.check_permissions('helmsman.change_chart', chart)
+        client = HelmClient()
         # 1. Guess which repo the chart came from
         repo_name = self._find_repo_for_chart(chart)
         if not repo_name:
             raise ChartNotFoundException(
                 "Could not find chart: %s, version: %s in any repository" %
                 (chart.name, chart.chart_version))
-        # 2. Apply the updated config to the chart
-        HelmClient().releases.update(
+        # 2. Skip upgrades that would not change anything
+        if not force and self._is_noop_update(client, chart, repo_name, values,
+                                              version, reset_values):
+            return chart
+        # 3. Apply the updated config to the chart
+        client.releases.update(
             chart.namespace, chart.id, "%s/%s" % (repo_name, chart.name), values=values,
             value_handling=HelmValueHandling.RESET if reset_values else HelmValueHandling.REUSE,
             version=version)
-        return self.get(chart.id)
+        return self.get(chart.id, namespace=chart.namespace)
 
     def rollback(self, chart, revision=None):
         self.check_permissions('helmsman.change_chart', chart)
         # Roll back to immediately preceding revision if revision=None
         HelmClient().releases.rollback(chart.namespace, chart.id, revision)
-        return self.get(chart.id)
+        return self.get(chart.id, namespace=chart.namespace)
 
     def delete(self, chart):
         self.check_permissions('helmsman.delete_chart', chart)
@@ -296,6 +391,23 @@ class HMInstallTemplateService(HelmsManService):
     def to_api_object(self, template):
         return HelmInstallTemplate(self, template)
 
+    @staticmethod
+    def _to_context(context):
+        # Context may also be given as yaml text, for example on the
+        # command line
+        if isinstance(context, str):
+            try:
+                context = yaml.safe_load(context)
+            except yaml.YAMLError as e:
+                raise InvalidInstallTemplateContextException(
+                    "Install template context is not valid yaml: %s" % e
+                ) from e
+        if context and not isinstance(context, dict):
+            raise InvalidInstallTemplateContextException(
+                "Install template context must be a mapping, not %s"
+                % type(context).__name__)
+        return context or None
+
     def create(self, name, repo, chart, chart_version=None,
                template=None, context=None, **kwargs):
         self.check_permissions('helmsman.add_install_template')
@@ -303,8 +415,8 @@ class HMInstallTemplateService(HelmsManService):
             with transaction.atomic():
                 obj = models.HMInstallTemplate.objects.create(
                     name=name, repo=repo, chart=chart,
-                    chart_version=chart_version,
-                    template=template, context=context, **kwargs)
+                    chart_version=chart_version, template=template,
+                    context=self._to_context(context), **kwargs)
             install_template = self.to_api_object(obj)
             return install_template
         except IntegrityError as e:
@@ -320,7 +432,7 @@ class HMInstallTemplateService(HelmsManService):
             obj.chart = chart
             obj.chart_version = chart_version
             obj.template = template
-            obj.context = context
+            obj.context = self._to_context(context)
             for attr, value in kwargs.items():
                 setattr(obj, attr, value)
             obj.save()
@@ -336,6 +448,17 @@ class HMInstallTemplateService(HelmsManService):
         self.check_permissions('helmsman.view_install_template', obj)
         return self.to_api_object(obj)
 
+    def render_values_many(self, name, contexts):
+        """
+        Renders the named install template against each of a list of
+        contexts. See HelmInstallTemplate.render_values_many.
+        Usage:
+            results = api.templates.render_values_many(
+                "galaxy", [{'project': {'name': 'first'}},
+                           {'project': {'name': 'second'}}])
+        """
+        return self.get(name).render_values_many(contexts)
+
     def delete(self, template):
         if template:
             self.check_permissions('helmsman.delete_install_template', template)
@@ -348,6 +471,19 @@ class HMInstallTemplateService(HelmsManService):
             (tmpl for tmpl in models.HMInstallTemplate.objects.all()
              if self.has_permissions('helmsman.view_install_template', tmpl))))
 
+    def find_by_chart(self):
+        """
+        Returns a dict mapping chart names to the install template which
+        find(chart_name=...) would return for each, loading all templates
+        with a single query.
+        """
+        templates = {}
+        for tmpl in models.HMInstallTemplate.objects.all():
+            templates.setdefault(tmpl.chart, tmpl)
+        return {chart: self.to_api_object(tmpl)
+                for chart, tmpl in templates.items()
+                if self.has_permissions('helmsman.view_install_template', tmpl)}
+
     def find(self, name=None, chart_name=None):
         search_terms = {'name': name, 'chart': chart_name}
         matches = list(models.HMInstallTemplate.objects.filter(
@@ -381,9 +517,21 @@ class HelmChart(HelmsManResource):
         self.state = kwargs.get('state')
         self.updated = kwargs.get('updated')
         self.access_address = '/%s/' % name
-        self.values = kwargs.get('values') or {}
+        self._values = kwargs.get('values')
+        self._values_loader = kwargs.get('values_loader')
         self.install_template = kwargs.get('install_template')
 
+    @property
+    def values(self):
+        if self._values is None:
+            self._values = ((self._values_loader() if self._values_loader
+                             else None) or {})
+        return self._values
+
+    @values.setter
+    def values(self, value):
+        self._values = value
+
     def delete(self):
         self.service.delete(self)
 
@@ -428,10 +576,7 @@ class HelmInstallTemplate(HelmsManResource):
 
     @property
     def context(self):
-        if self.template_obj.context:
-            return yaml.safe_load(self.template_obj.context)
-        else:
-            return {}
+        return self.template_obj.context or {}
 
     @property
     def display_name(self):
@@ -461,26 +606,45 @@ class HelmInstallTemplate(HelmsManResource):
     def screenshot_url(self):
         return self.template_obj.screenshot_url
 
-    def render_values(self, context):
+    def _get_compiled_template(self):
+        return templating.get_template(
+            self.template,
+            version=(self.name, self.template_obj.updated)
+            if self.template_obj.updated else None)
+
+    def _base_context(self):
         global_context = settings.CM_GLOBAL_CONTEXT
         # 1. Start with global context
         new_context = {'global': dict(global_context)}
         # 2. Add template default context
         new_context.update(self.context or {})
+        return new_context
+
+    def render_values(self, context):
+        new_context = self._base_context()
         # 3. Add user specified context
         new_context.update(context or {})
-        jinja2_env = self._get_jinja2_env()
-        tmpl = jinja2_env.from_string(
-            "\n".join([apps.get_app_config('helmsman').default_macros,
-                       self.template or '']))
+        tmpl = self._get_compiled_template()
         return tmpl.render({"context": new_context})
 
-    @staticmethod
-    def _get_jinja2_env():
-        env = jinja2.Environment(loader=jinja2.BaseLoader)
-        f = ipaddr.FilterModule()
-        env.filters.update(f.filters())
-        return env
+    def render_values_many(self, contexts):
+        """
+        Renders this template once for each of the given contexts, sharing
+        the compiled template and the global and default context between
+        renders. Returns a list with the rendered values for each context,
+        in the same order, or the exception raised while rendering it.
+        """
+        base_context = self._base_context()
+        tmpl = self._get_compiled_template()
+        results = []
+        for context in contexts:
+            new_context = dict(base_context)
+            new_context.update(context or {})
+            try:
+                results.append(tmpl.render({"context": new_context}))
+            except Exception as e:
+                results.append(e)
+        return results
 
     def install(self, namespace, release_name=None, values=None,
                 context=None):
@@ -496,7 +660,7 @@ class HelmInstallTemplate(HelmsManResource):
                                     values=[default_values, values or {}])
 
     def upgrade(self, chart, values=None,
-                context=None, reset_values=None):
+                context=None, reset_values=None, force=False):
         default_values = yaml.safe_load(
             self.render_values(context or {}))
         admin = User.objects.filter(is_superuser=True).first()
@@ -504,7 +668,8 @@ class HelmInstallTemplate(HelmsManResource):
         return client.charts.update(chart,
                                     version=self.chart_version,
                                     values=[default_values, values or {}],
-                                    reset_values=reset_values)
+                                    reset_values=reset_values,
+                                    force=force)
 
     def delete(self):
         self.service.delete(self.name)
@@ -1,13 +1,18 @@
 """A wrapper around the helm commandline client"""
-import contextlib
+import re
 import shutil
 
 from enum import Enum
 
+import yaml
+
 from clusterman.clients import helpers
 
 from helmsman import helpers as hm_helpers
 
+from .helm_repo_index import get_repo_freshness
+from .helm_repo_index import get_repo_index
+
 
 class HelmService(object):
     """Marker interface for CloudMan services"""
@@ -45,6 +50,31 @@ class HelmClient(HelmService):
         return self._repo_chart_svc
 
 
+class AsyncHelmClient(object):
+    """
+    Asyncio counterpart of HelmClient. Each service method is a coroutine
+    which runs the corresponding HelmClient method through an
+    AsyncCommandRunner, for example:
+        values = await AsyncHelmClient().releases.get_values(ns, name)
+    """
+
+    def __init__(self, client=None, runner=None):
+        self.client = client or HelmClient()
+        self.runner = runner or helpers.AsyncCommandRunner()
+
+    @property
+    def releases(self):
+        return helpers.AsyncServiceProxy(self.client.releases, self.runner)
+
+    @property
+    def repositories(self):
+        return helpers.AsyncServiceProxy(self.client.repositories, self.runner)
+
+    @property
+    def repo_charts(self):
+        return helpers.AsyncServiceProxy(self.client.repo_charts, self.runner)
+
+
 class HelmValueHandling(Enum):
     RESET = 0  # equivalent to --reset-values
     REUSE = 1  # equivalent to --reuse-values
@@ -56,39 +86,54 @@ class HelmReleaseService(HelmService):
     def __init__(self, client):
         super(HelmReleaseService, self).__init__(client)
 
-    def list(self, namespace=None):
+    @staticmethod
+    def _list_command(namespace=None):
         cmd = ["helm", "list"]
         if namespace:
             cmd += ["--namespace", namespace]
         else:
             cmd += ["--all-namespaces"]
-        data = helpers.run_list_command(cmd)
+        return cmd
+
+    def list(self, namespace=None):
+        data = helpers.run_list_command(self._list_command(namespace))
         return data
 
+    def stream(self, namespace=None):
+        """
+        Yields releases one at a time as they are read from helm.
+        """
+        return helpers.stream_list_command(self._list_command(namespace))
+
     def get(self, namespace, release_name):
-        return {}
+        """
+        Returns the release with the given name, in the same form as the
+        entries returned by list, or None if there is no such release. If
+        namespace is None, all namespaces are searched.
+        """
+        cmd = self._list_command(namespace) + [
+            "--filter", f"^{re.escape(release_name)}$"]
+        return next((release for release in helpers.run_list_command(cmd)
+                     if release.get('NAME') == release_name), None)
 
     def _set_values_and_run_command(self, cmd, values_list):
         """
-        Handles helm values by writing values to a temporary file,
-        after which the command is run. The temporary file is cleaned
-        up on exit from this method. This allows special values like braces
-        to be handled without complex escaping, which the helm --set flag
-        can't handle.
+        Handles helm values by passing them to helm as a yaml document on
+        stdin. This allows special values like braces to be handled without
+        complex escaping, which the helm --set flag can't handle.
 
-        The values can be a list of values files, in which case they will
-        all be written to multiple temp files and passed to helm.
+        The values can be a list of values dicts, in which case they are
+        merged in order, as helm would merge multiple values files, and
+        passed to helm as a single document.
         """
         if not isinstance(values_list, list):
             values_list = [values_list]
-        # contextlib.exitstack allows multiple temp files to be cleaned up
-        # on exit. ref: https://stackoverflow.com/a/19412700
-        with contextlib.ExitStack() as stack:
-            files = [stack.enter_context(hm_helpers.TempValuesFile(values))
-                     for values in values_list]
-            for file in files:
-                cmd += ["-f", file.name]
+        if not any(values_list):
             return helpers.run_command(cmd)
+        values = hm_helpers.merge_values(*values_list)
+        return helpers.run_command(
+            cmd + ["-f", "-"],
+            input=yaml.safe_dump(values, default_flow_style=False))
 
     def create(self, chart, namespace, release_name=None,
                version=None, values=None):
@@ -148,11 +193,11 @@ class HelmReleaseService(HelmService):
         get_all=True will also dump chart default values.
         get_all=False will only return user overridden values.
         """
-        cmd = ["helm", "get", "values", "-o", "yaml",
+        cmd = ["helm", "get", "values", "-o", "json",
                "--namespace", namespace, release_name]
         if get_all:
             cmd += ["--all"]
-        return helpers.run_yaml_command(cmd)
+        return helpers.run_json_command(cmd)
 
     @staticmethod
     def parse_chart_name(name):
@@ -180,8 +225,24 @@ class HelmRepositoryService(HelmService):
         data = helpers.run_list_command(["helm", "repo", "list"])
         return data
 
-    def update(self):
-        return helpers.run_command(["helm", "repo", "update"])
+    def update(self, repo_name=None):
+        """
+        Downloads the latest index of the given repository, or of all
+        repositories if no name is given.
+        """
+        output = helpers.run_command(
+            ["helm", "repo", "update"] + ([repo_name] if repo_name else []))
+        get_repo_freshness().record(repo_name)
+        return output
+
+    def ensure_fresh(self, repo_name=None, max_age=300):
+        """
+        Updates the given repository, or all repositories, unless it was
+        already updated within the last max_age seconds. Returns True if
+        an update was run.
+        """
+        return get_repo_freshness().ensure_fresh(
+            repo_name, max_age, lambda: self.update(repo_name))
 
     def create(self, repo_name, url):
         return helpers.run_command(["helm", "repo", "add", repo_name, url])
@@ -196,6 +257,11 @@ class HelmRepoChartService(HelmService):
         super(HelmRepoChartService, self).__init__(client)
 
     def list(self, chart_name=None, chart_version=None, search_hub=False):
+        # Look up charts in the local repository index, which reads the same
+        # cached index files as helm search, without running helm
+        index = get_repo_index()
+        if chart_name and not search_hub and index.available():
+            return index.find(chart_name, version=chart_version)
         # Perform exact match if chart_name specified.
         # https://github.com/helm/helm/issues/3890
         data = helpers.run_list_command(
@@ -210,6 +276,13 @@ class HelmRepoChartService(HelmService):
     def find(self, name, version, search_hub=False):
         return self.list(chart_name=name, chart_version=version, search_hub=search_hub)
 
+    def versions(self, chart_name, repo_name=None):
+        """
+        Returns the versions of a chart available in the configured
+        repositories, newest first.
+        """
+        return get_repo_index().versions(chart_name, repo_name=repo_name)
+
     def create(self, chart_name):
         raise Exception("Not implemented")
 
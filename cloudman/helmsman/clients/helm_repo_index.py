@@ -0,0 +1,317 @@
+"""
+An in-process index of the charts in the helm repositories configured on
+this host, built from the index files helm caches for each repository.
+"""
+import logging
+import os
+import re
+import threading
+import time
+
+import yaml
+
+from clusterman.clients.helpers import YAML_LOADER
+
+log = logging.getLogger(__name__)
+
+SEMVER_REGEX = re.compile(
+    r'^v?(\d+)(?:\.(\d+))?(?:\.(\d+))?'
+    r'(?:-([0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?$')
+
+
+def semver_key(version):
+    """
+    Returns a sort key which orders versions by semantic versioning
+    precedence. Pre-releases sort before the corresponding release, and
+    versions that are not valid semver sort before all others.
+    """
+    match = SEMVER_REGEX.match(str(version or "").strip())
+    if not match:
+        return (0, (), (), str(version))
+    major, minor, patch, pre = match.groups()
+    release = (int(major), int(minor or 0), int(patch or 0))
+    if not pre:
+        return (1, release, (1,), "")
+    # Numeric identifiers have lower precedence than alphanumeric ones
+    identifiers = tuple((0, int(part), "") if part.isdigit() else (1, 0, part)
+                        for part in pre.split("."))
+    return (1, release, (0,) + identifiers, "")
+
+
+def is_prerelease(version):
+    match = SEMVER_REGEX.match(str(version or "").strip())
+    return bool(match and match.group(4))
+
+
+def helm_config_path(env_var, xdg_var, default, *parts):
+    if os.environ.get(env_var):
+        return os.environ[env_var]
+    base = os.environ.get(xdg_var) or os.path.expanduser(default)
+    return os.path.join(base, "helm", *parts)
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class HelmRepoIndex(object):
+    """
+    Indexes chart versions by chart name across all configured repositories.
+    Helm's repositories file and each repository's cached index file are
+    only parsed again when they change on disk, for example after a
+    'helm repo add' or 'helm repo update'.
+    Usage:
+        index = HelmRepoIndex()
+        if index.available():
+            index.versions("galaxy")
+    """
+
+    def __init__(self, repository_config=None, repository_cache=None):
+        self.repository_config = repository_config or helm_config_path(
+            'HELM_REPOSITORY_CONFIG', 'XDG_CONFIG_HOME', '~/.config',
+            'repositories.yaml')
+        self.repository_cache = repository_cache or helm_config_path(
+            'HELM_REPOSITORY_CACHE', 'XDG_CACHE_HOME', '~/.cache',
+            'repository')
+        self._lock = threading.Lock()
+        self._config_signature = None
+        self._repos = {}
+        # repo name -> (file signature, chart name -> entries)
+        self._repo_charts = {}
+        # chart name -> [(repo name, entry)], newest versions first
+        self._charts = {}
+
+    def available(self):
+        """
+        Whether helm has a repositories file on this host. If not, helm
+        itself cannot search any repositories either.
+        """
+        return os.path.isfile(self.repository_config)
+
+    def _index_path(self, repo_name):
+        return os.path.join(self.repository_cache, f"{repo_name}-index.yaml")
+
+    def repo_names(self):
+        """
+        Returns the names of the configured repositories.
+        """
+        self.refresh()
+        return sorted(self._repos)
+
+    def last_updated(self, repo_name):
+        """
+        Returns the time at which helm last downloaded the index of a
+        repository, as a unix timestamp, or None if it has no cached index.
+        """
+        try:
+            return os.path.getmtime(self._index_path(repo_name))
+        except OSError:
+            return None
+
+    def _load_repositories(self):
+        with open(self.repository_config) as f:
+            config = yaml.load(f, Loader=YAML_LOADER) or {}
+        return {repo.get('name'): repo for repo in config.get(
+            'repositories') or [] if repo.get('name')}
+
+    def _load_index(self, repo_name):
+        with open(self._index_path(repo_name)) as f:
+            index = yaml.load(f, Loader=YAML_LOADER) or {}
+        return {name: entries or []
+                for name, entries in (index.get('entries') or {}).items()}
+
+    def refresh(self):
+        """
+        Reloads the repositories file and any index files that have changed
+        since they were last loaded.
+        """
+        with self._lock:
+            changed = False
+            signature = _file_signature(self.repository_config)
+            if signature != self._config_signature:
+                self._repos = (self._load_repositories()
+                               if signature else {})
+                self._config_signature = signature
+                changed = True
+            for repo_name in list(self._repo_charts):
+                if repo_name not in self._repos:
+                    del self._repo_charts[repo_name]
+                    changed = True
+            for repo_name in self._repos:
+                signature = _file_signature(self._index_path(repo_name))
+                loaded = self._repo_charts.get(repo_name)
+                if loaded and loaded[0] == signature:
+                    continue
+                try:
+                    charts = self._load_index(repo_name) if signature else {}
+                except (OSError, yaml.YAMLError) as e:
+                    log.warning("Could not load index of helm repository"
+                                " %s: %s", repo_name, e)
+                    charts = {}
+                self._repo_charts[repo_name] = (signature, charts)
+                changed = True
+            if changed:
+                self._rebuild()
+
+    def _rebuild(self):
+        charts = {}
+        for repo_name, (_, repo_charts) in sorted(self._repo_charts.items()):
+            for name, entries in repo_charts.items():
+                charts.setdefault(name, []).extend(
+                    (repo_name, entry) for entry in entries)
+        for entries in charts.values():
+            entries.sort(key=lambda item: semver_key(item[1].get('version')),
+                         reverse=True)
+        self._charts = charts
+
+    def entries(self, chart_name, repo_name=None):
+        """
+        Returns a list of (repo name, index entry) tuples for all versions
+        of a chart, newest first.
+        """
+        self.refresh()
+        return [(repo, entry)
+                for repo, entry in self._charts.get(chart_name, [])
+                if not repo_name or repo == repo_name]
+
+    def versions(self, chart_name, repo_name=None):
+        """
+        Returns the distinct versions of a chart, newest first.
+        """
+        versions = []
+        for _, entry in self.entries(chart_name, repo_name):
+            if entry.get('version') not in versions:
+                versions.append(entry.get('version'))
+        return versions
+
+    def find(self, chart_name, version=None, devel=False):
+        """
+        Returns the charts with the given name in the same form as
+        'helm search repo'. That is, the newest version in each repository,
+        or the given version if one is specified. As with helm, pre-release
+        versions are only considered as the newest version if devel=True.
+        """
+        results = {}
+        for repo, entry in self.entries(chart_name):
+            if repo in results:
+                continue
+            if version:
+                if entry.get('version') != version:
+                    continue
+            elif not devel and is_prerelease(entry.get('version')):
+                continue
+            results[repo] = {
+                'NAME': f"{repo}/{chart_name}",
+                'CHART VERSION': entry.get('version'),
+                'APP VERSION': entry.get('appVersion', ''),
+                'DESCRIPTION': entry.get('description', '')
+            }
+        return [results[repo] for repo in sorted(results)]
+
+
+_repo_index = None
+_repo_index_lock = threading.Lock()
+
+
+def get_repo_index():
+    """
+    Returns a process-wide HelmRepoIndex, so that index files are only
+    parsed once per change rather than once per lookup.
+    """
+    global _repo_index
+    with _repo_index_lock:
+        if not _repo_index:
+            _repo_index = HelmRepoIndex()
+        return _repo_index
+
+
+class RepoFreshness(object):
+    """
+    Tracks when each helm repository was last updated, so that repositories
+    are only updated once they are older than a given age. Concurrent
+    callers needing the same repository updated share a single in-flight
+    update rather than each running their own.
+    """
+
+    def __init__(self, repo_index=None):
+        self.repo_index = repo_index
+        # Reentrant, as freshness is checked again while holding the lock
+        self._lock = threading.RLock()
+        # repo name, or None for all repositories -> time of last update
+        self._updated = {}
+        # repo name, or None for all repositories -> event set when the
+        # in-flight update completes
+        self._in_flight = {}
+
+    def _index(self):
+        return self.repo_index or get_repo_index()
+
+    def record(self, repo_name=None):
+        with self._lock:
+            self._updated[repo_name] = time.time()
+
+    def last_updated(self, repo_name=None):
+        with self._lock:
+            updated = [self._updated.get(repo_name), self._updated.get(None)]
+        # Helm rewrites the cached index of a repository when it is updated,
+        # which is also seen by other processes sharing the same cache
+        index = self._index()
+        if repo_name:
+            updated.append(index.last_updated(repo_name))
+        elif index.available():
+            times = [index.last_updated(name) for name in index.repo_names()]
+            if times and None not in times:
+                updated.append(min(times))
+        return max(filter(None, updated), default=None)
+
+    def is_fresh(self, repo_name=None, max_age=300):
+        updated = self.last_updated(repo_name)
+        return bool(updated and time.time() - updated < max_age)
+
+    def ensure_fresh(self, repo_name, max_age, update):
+        """
+        Calls update unless the repository is fresh, or waits for an update
+        of the same repository already in progress. Returns True if this
+        caller ran the update.
+        """
+        while not self.is_fresh(repo_name, max_age):
+            with self._lock:
+                event = self._in_flight.get(repo_name)
+                owner = event is None
+                if owner:
+                    # Check again now that no update can start or finish,
+                    # in case one finished since the check above
+                    if self.is_fresh(repo_name, max_age):
+                        return False
+                    event = self._in_flight[repo_name] = threading.Event()
+            if not owner:
+                # Wait for the update in progress and check again, so that
+                # a failed update is retried by one of the waiting callers
+                event.wait()
+                continue
+            try:
+                update()
+                return True
+            finally:
+                with self._lock:
+                    del self._in_flight[repo_name]
+                event.set()
+        return False
+
+
+_repo_freshness = None
+
+
+def get_repo_freshness():
+    """
+    Returns the process-wide RepoFreshness tracker.
+    """
+    global _repo_freshness
+    with _repo_index_lock:
+        if not _repo_freshness:
+            _repo_freshness = RepoFreshness()
+        return _repo_freshness
@@ -0,0 +1,140 @@
+"""
+Reads helm 3 releases directly from the kubernetes secrets in which helm
+stores them, instead of running helm once per release.
+"""
+import base64
+import gzip
+import json
+import re
+
+from clusterman.clients import helpers
+
+GZIP_MAGIC = b"\x1f\x8b"
+# The states in which 'helm list' shows a release by default
+LISTED_STATES = {"deployed", "failed"}
+RFC3339_REGEX = re.compile(
+    r'^(\d{4}-\d{2}-\d{2})T(\d{2}:\d{2}:\d{2})(?:\.(\d+))?'
+    r'(Z|[+-]\d{2}:\d{2})$')
+
+
+def decode_release(data):
+    """
+    Decodes the release field of a helm storage secret. The field holds a
+    base64 encoded (by kubernetes), base64 encoded (by helm), usually
+    gzipped, json document describing a single release revision.
+    """
+    raw = base64.b64decode(base64.b64decode(data))
+    if raw[:2] == GZIP_MAGIC:
+        raw = gzip.decompress(raw)
+    return json.loads(raw)
+
+
+def format_time(timestamp):
+    """
+    Formats a timestamp from a stored release, such as
+    2020-06-01T10:00:00.250Z, in the same way as 'helm list', which prints
+    go's default time format: 2020-06-01 10:00:00.25 +0000 UTC
+    """
+    match = RFC3339_REGEX.match(timestamp or "")
+    if not match:
+        return timestamp
+    date, time, fraction, zone = match.groups()
+    fraction = (fraction or "")[:9].rstrip("0")
+    if zone in ("Z", "+00:00"):
+        zone = "+0000 UTC"
+    else:
+        # go names zones it does not know after their offset
+        offset = zone.replace(":", "")
+        zone = f"{offset} {offset}"
+    return f"{date} {time}{'.' + fraction if fraction else ''} {zone}"
+
+
+def coalesce_values(defaults, overrides):
+    """
+    Merges user supplied values over chart defaults in the same way as
+    helm, recursing into nested dicts. A null override removes the default.
+    """
+    merged = dict(defaults or {})
+    for key, value in (overrides or {}).items():
+        if value is None:
+            merged.pop(key, None)
+        elif isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = coalesce_values(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class HelmReleaseStorage(object):
+    """
+    Lists releases and their values from helm's storage secrets, fetching
+    all revisions of all releases with a single kubectl call. Rows are
+    returned in the same form as the equivalent HelmReleaseService methods,
+    which parse helm's tabular output.
+    """
+
+    @staticmethod
+    def _fetch(namespace=None):
+        cmd = ["kubectl", "get", "secrets", "-l", "owner=helm", "-o", "json"]
+        if namespace:
+            cmd += ["--namespace", namespace]
+        else:
+            cmd += ["--all-namespaces"]
+        data = helpers.run_json_command(cmd) or {}
+        return [decode_release(secret['data']['release'])
+                for secret in data.get('items', [])
+                if (secret.get('data') or {}).get('release')]
+
+    @staticmethod
+    def _chart(release):
+        metadata = (release.get('chart') or {}).get('metadata') or {}
+        return (f"{metadata.get('name')}-{metadata.get('version')}",
+                metadata.get('appVersion', ''))
+
+    @staticmethod
+    def values(release, get_all=True):
+        """
+        Returns the values of a decoded release. get_all=True includes the
+        chart's default values, as for 'helm get values --all'.
+        """
+        if get_all:
+            return coalesce_values(
+                (release.get('chart') or {}).get('values'),
+                release.get('config'))
+        return release.get('config') or {}
+
+    def _to_row(self, release):
+        chart, app_version = self._chart(release)
+        info = release.get('info') or {}
+        return {
+            'NAME': release.get('name'),
+            'NAMESPACE': release.get('namespace'),
+            'REVISION': str(release.get('version')),
+            'UPDATED': format_time(info.get('last_deployed')),
+            'STATUS': info.get('status'),
+            'CHART': chart,
+            'APP VERSION': app_version
+        }
+
+    def _latest(self, namespace=None):
+        latest = {}
+        for release in self._fetch(namespace):
+            key = (release.get('namespace'), release.get('name'))
+            if (key not in latest or
+                    release.get('version') > latest[key].get('version')):
+                latest[key] = release
+        # As in helm, a release is only listed if its latest revision is in
+        # a listed state, rather than showing an older revision instead.
+        return [latest[key] for key in sorted(latest)
+                if (latest[key].get('info') or {}).get('status')
+                in LISTED_STATES]
+
+    def list(self, namespace=None):
+        return [self._to_row(release) for release in self._latest(namespace)]
+
+    def list_with_values(self, namespace=None, get_all=True):
+        """
+        Returns a list of (row, values) tuples for each listed release.
+        """
+        return [(self._to_row(release), self.values(release, get_all))
+                for release in self._latest(namespace)]
@@ -1,3 +1,5 @@
+import hashlib
+import json
 import tempfile
 import yaml
 from django.conf import settings
@@ -51,3 +53,43 @@ def flatten_dict(d):
             else:
                 yield key, value
     return dict(items())
+
+
+def merge_values(*layers):
+    """
+    Merges helm values layers in the same way as helm merges multiple
+    values files: later layers override earlier ones, nested dicts are
+    merged recursively, and lists and other values are replaced outright.
+    Null values are kept, so that helm can still use them to remove chart
+    defaults. Layers that are None are skipped.
+
+    Usage:
+        merge_values({'a': {'b': 1}}, {'a': {'c': 2}})
+        => {'a': {'b': 1, 'c': 2}}
+    """
+    merged = {}
+    for layer in layers:
+        if layer:
+            merged = _merge_dicts(merged, layer)
+    return merged
+
+
+def _merge_dicts(base, override):
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge_dicts(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def values_fingerprint(chart_version, values):
+    """
+    Returns a digest identifying a chart version together with a set of
+    values, independent of the order of keys in the values.
+    """
+    document = json.dumps({'chart_version': chart_version,
+                           'values': values or {}},
+                          sort_keys=True, default=str)
+    return hashlib.sha256(document.encode('utf-8')).hexdigest()
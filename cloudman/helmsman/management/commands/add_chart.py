@@ -28,24 +28,28 @@ class Command(BaseCommand):
         parser.add_argument('--upgrade', dest='upgrade_chart',
                             action='store_true',
                             help='upgrade chart if it already exists')
+        parser.add_argument('--force_upgrade', dest='force_upgrade',
+                            action='store_true',
+                            help='upgrade chart even if its version and'
+                                 ' values are unchanged')
 
     def handle(self, *args, **options):
         self.add_chart(options['chart_ref'], options['namespace'],
                        options['release_name'], options['chart_version'],
                        options['values_file'], options['create_namespace'],
-                       options['upgrade_chart'])
+                       options['upgrade_chart'], options['force_upgrade'])
 
     @staticmethod
     def add_chart(chart_ref, namespace, release_name, version, values_file,
-                  create_namespace, upgrade_chart):
+                  create_namespace, upgrade_chart, force_upgrade=False):
         Command.install_or_upgrade(chart_ref, namespace, release_name,
                                    version, values_file, create_namespace,
-                                   upgrade_chart)
+                                   upgrade_chart, force_upgrade)
 
     @staticmethod
     def install_or_upgrade(chart_ref, namespace, release_name,
                            version, values_file, create_namespace,
-                           upgrade_chart):
+                           upgrade_chart, force_upgrade=False):
         admin = User.objects.filter(is_superuser=True).first()
         client = HelmsManAPI(HMServiceContext(user=admin))
         repo_name, chart_name = chart_ref.split("/")
@@ -67,7 +71,8 @@ class Command(BaseCommand):
         if chart and upgrade_chart:
             print(f"Upgrading chart {repo_name}/{chart_name} in namespace"
                   f" {namespace}")
-            client.charts.update(chart, values, version=version)
+            client.charts.update(chart, values, version=version,
+                                 force=force_upgrade)
         else:
             print(f"Installing chart {repo_name}/{chart_name} into namespace"
                   f" {namespace}")
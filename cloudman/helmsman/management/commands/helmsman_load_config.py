@@ -66,6 +66,8 @@ class Command(BaseCommand):
                 extra_args["chart_version"] = chart.get('version')
             if chart.get('upgrade'):
                 extra_args["upgrade"] = True
+            if chart.get('force_upgrade'):
+                extra_args["force_upgrade"] = True
             if chart.get('values'):
                 values = chart.get('values')
                 with helpers.TempValuesFile(values) as f:
@@ -0,0 +1,32 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from ... import models
+from ... import templating
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Compiles all install templates, so that worker processes can'
+            ' load them from the template bytecode cache')
+
+    def handle(self, *args, **options):
+        self.warm_template_cache()
+
+    @staticmethod
+    def warm_template_cache():
+        compiled = 0
+        for template in models.HMInstallTemplate.objects.all():
+            try:
+                templating.get_template(
+                    template.template,
+                    version=(template.name, template.updated))
+                compiled += 1
+            except Exception as e:
+                log.exception(f"An error occurred while compiling the "
+                              f"template '{template.name}'")
+                print(f"An error occurred while compiling the template "
+                      f"'{template.name}':", str(e))
+        print(f"Compiled {compiled} install templates.")
@@ -0,0 +1,59 @@
+# Generated by Django 3.1.4 on 2026-10-18 09:12
+import yaml
+
+from django.db import migrations, models
+
+
+def context_to_json(apps, schema_editor):
+    HMInstallTemplate = apps.get_model('helmsman', 'HMInstallTemplate')
+    for template in HMInstallTemplate.objects.exclude(context=None):
+        # The text column is removed below, so refuse to migrate a context
+        # that cannot be stored as json rather than discarding it
+        try:
+            context = yaml.safe_load(template.context)
+        except yaml.YAMLError as e:
+            raise ValueError(
+                f"The context of install template '{template.name}'"
+                f" (pk={template.pk}) is not valid yaml. Correct or clear it"
+                f" and run the migration again: {e}") from e
+        if context is not None and not isinstance(context, dict):
+            raise ValueError(
+                f"The context of install template '{template.name}'"
+                f" (pk={template.pk}) is not a mapping. Correct or clear it"
+                f" and run the migration again.")
+        HMInstallTemplate.objects.filter(pk=template.pk).update(
+            context_json=context)
+
+
+def context_to_text(apps, schema_editor):
+    HMInstallTemplate = apps.get_model('helmsman', 'HMInstallTemplate')
+    for template in HMInstallTemplate.objects.exclude(context_json=None):
+        HMInstallTemplate.objects.filter(pk=template.pk).update(
+            context=yaml.safe_dump(template.context_json,
+                                   default_flow_style=False))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helmsman', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hminstalltemplate',
+            name='context_json',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        # update() is used so that the updated timestamp is left unchanged
+        migrations.RunPython(context_to_json, context_to_text),
+        migrations.RemoveField(
+            model_name='hminstalltemplate',
+            name='context',
+        ),
+        migrations.RenameField(
+            model_name='hminstalltemplate',
+            old_name='context_json',
+            new_name='context',
+        ),
+    ]
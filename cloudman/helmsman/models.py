@@ -14,7 +14,7 @@ class HMInstallTemplate(models.Model):
     chart = models.SlugField(max_length=60)
     chart_version = models.CharField(max_length=60, blank=True, null=True)
     template = models.TextField(blank=True, null=True)
-    context = models.TextField(blank=True, null=True)
+    context = models.JSONField(blank=True, null=True)
     display_name = models.TextField(blank=True, null=True)
     summary = models.TextField(blank=True, null=True)
     description = models.TextField(blank=True, null=True)
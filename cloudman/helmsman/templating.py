@@ -0,0 +1,168 @@
+"""
+Compiles install templates with a single, process-wide jinja2 environment,
+and caches the compiled templates so that templates rendered repeatedly are
+only parsed once. Compiled bytecode is also cached on disk, so that new
+worker processes can load templates without compiling them.
+"""
+import collections
+import hashlib
+import logging
+import os
+import threading
+
+import jinja2
+
+from ansible.plugins.filter import ipaddr
+
+from django.apps import apps
+from django.conf import settings
+
+log = logging.getLogger(__name__)
+
+
+def source_digest(source):
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def template_source(template):
+    """
+    Returns the full source of an install template, which is the template
+    text prefixed with helmsman's default macros.
+    """
+    return "\n".join([apps.get_app_config('helmsman').default_macros,
+                      template or ''])
+
+
+_env = None
+_env_lock = threading.Lock()
+
+
+def _bytecode_cache():
+    directory = settings.HELMSMAN_TEMPLATE_BYTECODE_CACHE_DIR
+    if directory is None:
+        # jinja2's default is a per-user directory under the temp dir, which
+        # it checks is owned by this user and private
+        return jinja2.FileSystemBytecodeCache()
+    if not directory:
+        return None
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        stat = os.lstat(directory)
+    except OSError as e:
+        log.warning("Not caching template bytecode in %s: %s", directory, e)
+        return None
+    # Bytecode is executed when loaded, so only trust a private directory
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        log.warning("Not caching template bytecode in %s: the directory must"
+                    " be owned by this user and not accessible to others",
+                    directory)
+        return None
+    return jinja2.FileSystemBytecodeCache(directory)
+
+
+def get_jinja2_env():
+    """
+    Returns the jinja2 environment shared by all install templates, with
+    the ansible ipaddr filters registered.
+    """
+    global _env
+    with _env_lock:
+        if not _env:
+            env = jinja2.Environment(loader=jinja2.BaseLoader,
+                                     bytecode_cache=_bytecode_cache())
+            env.filters.update(ipaddr.FilterModule().filters())
+            _env = env
+        return _env
+
+
+def compile_template(digest, source):
+    """
+    Compiles a template, loading its bytecode from the bytecode cache if
+    it has already been compiled by any process. The cache entry is named
+    after the digest of the source, and is only used if the source matches.
+    """
+    env = get_jinja2_env()
+    bucket = code = None
+    if env.bytecode_cache:
+        bucket = env.bytecode_cache.get_bucket(env, digest, None, source)
+        code = bucket.code
+    if code is None:
+        code = env.compile(source, digest)
+        if bucket:
+            bucket.code = code
+            env.bytecode_cache.set_bucket(bucket)
+    return env.template_class.from_code(env, code, env.make_globals(None))
+
+
+class TemplateCache(object):
+    """
+    A least recently used cache of compiled templates, keyed by a digest of
+    the template source. A version, such as the name and last update time of
+    an install template, can be given with the source so that the digest is
+    only computed again when the version changes.
+    Usage:
+        cache = TemplateCache(maxsize=10)
+        cache.get(template_source(text), version=("galaxy", updated))
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        # digest -> compiled template, least recently used first
+        self._templates = collections.OrderedDict()
+        # version -> digest
+        self._digests = {}
+
+    def _compile(self, digest, source):
+        return compile_template(digest, source)
+
+    def get(self, source, version=None):
+        with self._lock:
+            digest = self._digests.get(version) if version else None
+        if not digest:
+            digest = source_digest(source)
+        with self._lock:
+            if version:
+                self._digests[version] = digest
+            template = self._templates.get(digest)
+            if template:
+                self._templates.move_to_end(digest)
+                return template
+        template = self._compile(digest, source)
+        with self._lock:
+            self._templates[digest] = template
+            while len(self._templates) > self.maxsize:
+                evicted, _ = self._templates.popitem(last=False)
+                self._digests = {v: d for v, d in self._digests.items()
+                                 if d != evicted}
+        return template
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+            self._digests.clear()
+
+    def __len__(self):
+        return len(self._templates)
+
+
+_template_cache = None
+
+
+def get_template_cache():
+    """
+    Returns the process-wide cache of compiled install templates.
+    """
+    global _template_cache
+    with _env_lock:
+        if not _template_cache:
+            _template_cache = TemplateCache(
+                maxsize=settings.HELMSMAN_TEMPLATE_CACHE_SIZE)
+        return _template_cache
+
+
+def get_template(template, version=None):
+    """
+    Returns the compiled form of an install template's text.
+    """
+    return get_template_cache().get(template_source(template), version)
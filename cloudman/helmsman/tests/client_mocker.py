@@ -21,10 +21,15 @@ class HelmMocker(object):
     def extra_patches():
         return [patch(
             'helmsman.clients.helm_client.HelmClient._check_environment',
-            return_value=True)]
-
-    def run_command(self, command):
-        return self.mock_helm.run_command(command)
+            return_value=True),
+            # search the mock repos through helm instead of any real
+            # repository index on this host
+            patch(
+            'helmsman.clients.helm_repo_index.HelmRepoIndex.available',
+            return_value=False)]
+
+    def run_command(self, command, input=None):
+        return self.mock_helm.run_command(command, input=input)
 
 
 class ClientMocker(CMClientMocker):
@@ -1,6 +1,7 @@
 import argparse
 import csv
 from io import StringIO
+import json
 import re
 import uuid
 import yaml
@@ -99,6 +100,9 @@ class MockHelm(object):
                                  help='list releases from all namespaces')
         parser_list.add_argument('--namespace', type=self.validate_namespace,
                                  help='namespace')
+        parser_list.add_argument(
+            '--filter', type=str,
+            help='regular expression to filter release names by')
         parser_list.set_defaults(func=self._helm_list)
 
         # Helm install
@@ -158,6 +162,8 @@ class MockHelm(object):
         parser_repo = subparsers.add_parser('repo', help='repo commands')
         subparser_repo = parser_repo.add_subparsers()
         p_repo_update = subparser_repo.add_parser('update', help='update repo')
+        p_repo_update.add_argument('repo_names', type=str, nargs='*',
+                                   help='names of repos to update')
         p_repo_update.set_defaults(func=self._helm_repo_update)
         p_repo_add = subparser_repo.add_parser('add', help='install repo')
         p_repo_add.add_argument('name', type=str, help='repo name')
@@ -209,11 +215,23 @@ class MockHelm(object):
 
         return parser
 
-    def run_command(self, command):
+    def run_command(self, command, input=None):
         # evaluate command
         args = self.parser.parse_args(command[1:])
+        args.stdin = input
         return args.func(args)
 
+    @staticmethod
+    def _load_values_files(args):
+        # flatten the values file list, reading '-' from stdin as helm does
+        value_files = [f for vfl in args.values or [] for f in vfl]
+        for vals_file in value_files:
+            if vals_file == '-':
+                yield yaml.safe_load(args.stdin or "")
+            else:
+                with open(vals_file, 'r') as f:
+                    yield yaml.safe_load(f)
+
     def _helm_list(self, args):
         # pretend to succeed
         with StringIO() as output:
@@ -223,6 +241,8 @@ class MockHelm(object):
             writer.writeheader()
             for release in self.chart_database.values():
                 last = release[-1]
+                if args.filter and not re.search(args.filter, last.get("NAME")):
+                    continue
                 if args.namespace and last.get("NAMESPACE"):
                     if args.namespace == last.get("NAMESPACE"):
                         # Write data about the latest revision for each chart
@@ -245,13 +265,9 @@ class MockHelm(object):
             'DESCRIPTION': 'Initial Install',
             'VALUES': {}
         }
-        # flatten the values file list
-        value_files = [f for vfl in args.values or [] for f in vfl]
-        for vals_file in value_files:
-            with open(vals_file, 'r') as f:
-                values = yaml.safe_load(f)
-                revision['VALUES'] = jsonmerge.merge(
-                    revision.get('VALUES') or {}, values)
+        for values in self._load_values_files(args):
+            revision['VALUES'] = jsonmerge.merge(
+                revision.get('VALUES') or {}, values)
         self.chart_database[release_name] = [revision]
         return revision
 
@@ -266,13 +282,9 @@ class MockHelm(object):
             new_release['CHART'] = '%s-%s' % (chart_name, args.version or "1.0.0")
         new_release['REVISION'] += 1
         new_release['DESCRIPTION'] = 'Upgraded successfully'
-        # flatten the values file list
-        value_files = [f for vfl in args.values or [] for f in vfl]
-        for vals_file in value_files:
-            with open(vals_file, 'r') as f:
-                values = yaml.safe_load(f)
-                new_release['VALUES'] = jsonmerge.merge(
-                    new_release.get('VALUES') or {}, values)
+        for values in self._load_values_files(args):
+            new_release['VALUES'] = jsonmerge.merge(
+                new_release.get('VALUES') or {}, values)
         revisions.append(new_release)
         return new_release
 
@@ -335,7 +347,9 @@ class MockHelm(object):
             return 'Error: release: "%s" not found' % args.release
         latest_release = revisions[-1]
         with StringIO() as output:
-            if args.output == "yaml":
+            if args.output == "json":
+                json.dump(latest_release.get('VALUES'), output)
+            elif args.output == "yaml":
                 yaml.safe_dump(latest_release.get('VALUES'), output, allow_unicode=True)
             else:
                 output.write("USER-SUPPLIED VALUES:")
@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import yaml
+
+from django.test import TestCase
+
+from helmsman.clients.helm_repo_index import HelmRepoIndex
+from helmsman.clients.helm_repo_index import RepoFreshness
+from helmsman.clients.helm_repo_index import semver_key
+
+
+class RepoIndexTestBase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.config = os.path.join(self.tmpdir, "repositories.yaml")
+        self._write(self.config, {"repositories": [
+            {"name": "cloudve",
+             "url": "https://github.com/CloudVE/helm-charts/raw/master/"},
+            {"name": "stable", "url": "https://charts.helm.sh/stable"}]})
+        self._write_index("cloudve", {
+            "galaxy": ["3.3.0", "3.10.0", "4.0.0-rc.1", "3.9.1"],
+            "cloudlaunch": ["0.2.0"]})
+        self._write_index("stable", {"galaxy": ["1.0.0"]})
+        self.index = HelmRepoIndex(repository_config=self.config,
+                                   repository_cache=self.tmpdir)
+
+    def _write(self, path, data):
+        with open(path, "w") as f:
+            yaml.safe_dump(data, f)
+
+    def _write_index(self, repo, charts):
+        self._write(os.path.join(self.tmpdir, f"{repo}-index.yaml"), {
+            "apiVersion": "v1",
+            "entries": {name: [{"name": name, "version": v, "appVersion": "1",
+                                "description": f"{name} chart"}
+                               for v in versions]
+                        for name, versions in charts.items()}})
+
+
+class HelmRepoIndexTests(RepoIndexTestBase):
+
+    def test_versions_are_semver_sorted(self):
+        self.assertEqual(self.index.versions("galaxy", repo_name="cloudve"),
+                         ["4.0.0-rc.1", "3.10.0", "3.9.1", "3.3.0"])
+        self.assertEqual(self.index.versions("galaxy")[-1], "1.0.0")
+        self.assertEqual(self.index.versions("missing"), [])
+
+    def test_find(self):
+        self.assertEqual(
+            [(r['NAME'], r['CHART VERSION'])
+             for r in self.index.find("galaxy")],
+            [("cloudve/galaxy", "3.10.0"), ("stable/galaxy", "1.0.0")])
+        self.assertEqual(
+            [r['CHART VERSION']
+             for r in self.index.find("galaxy", devel=True)],
+            ["4.0.0-rc.1", "1.0.0"])
+        self.assertEqual(
+            [r['CHART VERSION']
+             for r in self.index.find("galaxy", version="4.0.0-rc.1")],
+            ["4.0.0-rc.1"])
+        self.assertEqual(
+            [r['NAME'] for r in self.index.find("galaxy", version="1.0.0")],
+            ["stable/galaxy"])
+
+    def test_reload_on_change(self):
+        self.assertEqual(self.index.versions("cloudlaunch"), ["0.2.0"])
+        self._write_index("cloudve", {"cloudlaunch": ["0.2.0", "0.3.0"]})
+        # make sure the change is visible even on coarse mtime filesystems
+        path = os.path.join(self.tmpdir, "cloudve-index.yaml")
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(self.index.versions("cloudlaunch"), ["0.3.0", "0.2.0"])
+        self.assertEqual(self.index.versions("galaxy"), ["1.0.0"])
+
+    def test_semver_key(self):
+        versions = ["1.0.0", "1.0.0-alpha", "1.0.0-alpha.1", "1.0.0-beta",
+                    "1.0.0-alpha.beta", "0.9", "v2.0.0", "latest"]
+        self.assertEqual(sorted(versions, key=semver_key),
+                         ["latest", "0.9", "1.0.0-alpha", "1.0.0-alpha.1",
+                          "1.0.0-alpha.beta", "1.0.0-beta", "1.0.0", "v2.0.0"])
+
+
+class RepoFreshnessTests(RepoIndexTestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.freshness = RepoFreshness(repo_index=self.index)
+        self.updates = []
+
+    def _age(self, repo, seconds):
+        path = os.path.join(self.tmpdir, f"{repo}-index.yaml")
+        mtime = time.time() - seconds
+        os.utime(path, (mtime, mtime))
+
+    def _update(self, repo_name=None):
+        self.updates.append(repo_name)
+        self.freshness.record(repo_name)
+
+    def test_fresh_repo_is_not_updated(self):
+        self.assertFalse(self.freshness.ensure_fresh(
+            "cloudve", 300, lambda: self._update("cloudve")))
+        self.assertEqual(self.updates, [])
+
+    def test_stale_repo_is_updated_once(self):
+        self._age("cloudve", 600)
+        self._age("stable", 600)
+        for _ in range(3):
+            self.freshness.ensure_fresh(
+                "cloudve", 300, lambda: self._update("cloudve"))
+        self.assertEqual(self.updates, ["cloudve"])
+        # other repos are left alone
+        self.assertFalse(self.freshness.is_fresh("stable", 300))
+        # updating all repos refreshes each of them
+        self.freshness.ensure_fresh(None, 300, lambda: self._update())
+        self.assertTrue(self.freshness.is_fresh("stable", 300))
+        self.assertEqual(self.updates, ["cloudve", None])
+
+    def test_concurrent_callers_share_update(self):
+        self._age("cloudve", 600)
+        started = threading.Event()
+        finish = threading.Event()
+
+        def slow_update():
+            started.set()
+            finish.wait(5)
+            self._update("cloudve")
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            self.freshness.ensure_fresh("cloudve", 300, slow_update)))
+            for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+        finish.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(self.updates, ["cloudve"])
+        self.assertEqual(sorted(results), [False] * 4 + [True])
@@ -0,0 +1,98 @@
+import base64
+import gzip
+import json
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from helmsman.clients.helm_storage import HelmReleaseStorage
+from helmsman.clients.helm_storage import coalesce_values
+from helmsman.clients.helm_storage import format_time
+
+
+def _release(name, version, status, config=None, namespace="default"):
+    return {
+        "name": name,
+        "namespace": namespace,
+        "version": version,
+        "info": {"status": status,
+                 "last_deployed": "2020-06-01T10:00:00Z",
+                 "description": f"Revision {version}"},
+        "chart": {"metadata": {"name": "galaxy", "version": f"3.{version}.0",
+                               "appVersion": "20.05"},
+                  "values": {"image": {"tag": "latest", "pull": "Always"},
+                             "replicas": 1}},
+        "config": config or {}
+    }
+
+
+def _secret(release):
+    encoded = base64.b64encode(gzip.compress(json.dumps(release).encode()))
+    return {"kind": "Secret",
+            "metadata": {"name": f"sh.helm.release.v1.{release['name']}"
+                                 f".v{release['version']}",
+                         "labels": {"owner": "helm", "name": release['name']}},
+            "data": {"release": base64.b64encode(encoded).decode()}}
+
+
+class HelmReleaseStorageTests(TestCase):
+
+    def setUp(self):
+        releases = [
+            _release("galaxy", 1, "superseded"),
+            _release("galaxy", 2, "deployed", {"image": {"tag": "20.05"}}),
+            _release("cvmfs", 1, "deployed", namespace="kube-system"),
+            _release("removed", 1, "uninstalled"),
+        ]
+        self.secrets = [_secret(release) for release in releases]
+        patcher = patch('clusterman.clients.helpers.run_command',
+                        side_effect=self._kubectl_get_secrets)
+        self.run_command = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.storage = HelmReleaseStorage()
+
+    def _kubectl_get_secrets(self, command):
+        selector = dict(term.split("=")
+                        for term in command[command.index("-l") + 1].split(","))
+        items = [secret for secret in self.secrets
+                 if selector.items() <= secret['metadata']['labels'].items()]
+        return json.dumps({"kind": "List", "items": items})
+
+    def test_list_latest_revisions(self):
+        rows = self.storage.list()
+        self.assertEqual(self.run_command.call_count, 1)
+        self.assertEqual(
+            [(r['NAMESPACE'], r['NAME'], r['REVISION']) for r in rows],
+            [("default", "galaxy", "2"), ("kube-system", "cvmfs", "1")])
+        self.assertEqual(rows[0]['CHART'], "galaxy-3.2.0")
+        self.assertEqual(rows[0]['STATUS'], "deployed")
+        self.assertEqual(rows[0]['UPDATED'], "2020-06-01 10:00:00 +0000 UTC")
+
+    def test_list_filters_on_latest_revision(self):
+        # helm does not fall back to an older deployed revision while a
+        # release is being upgraded
+        self.secrets += [_secret(_release("upgrading", 1, "deployed")),
+                         _secret(_release("upgrading", 2, "pending-upgrade"))]
+        self.assertEqual([r['NAME'] for r in self.storage.list()],
+                         ["galaxy", "cvmfs"])
+
+    def test_values(self):
+        _, values = self.storage.list_with_values()[0]
+        self.assertEqual(values, {"image": {"tag": "20.05", "pull": "Always"},
+                                  "replicas": 1})
+        _, values = self.storage.list_with_values(get_all=False)[0]
+        self.assertEqual(values, {"image": {"tag": "20.05"}})
+
+    def test_format_time(self):
+        self.assertEqual(format_time("2020-06-01T10:00:00.250000Z"),
+                         "2020-06-01 10:00:00.25 +0000 UTC")
+        self.assertEqual(
+            format_time("2021-03-04T11:20:33.123456789-05:00"),
+            "2021-03-04 11:20:33.123456789 -0500 -0500")
+        self.assertEqual(format_time("not a time"), "not a time")
+
+    def test_coalesce_values_removes_nulls(self):
+        self.assertEqual(
+            coalesce_values({"a": {"b": 1, "c": 2}, "d": 3},
+                            {"a": {"c": None}, "d": None, "e": 4}),
+            {"a": {"b": 1}, "e": 4})
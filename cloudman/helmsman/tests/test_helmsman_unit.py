@@ -1,8 +1,18 @@
+from unittest.mock import patch
+
+import yaml
+
 from django.contrib.auth.models import User
 from django.test import TestCase, override_settings
 
+from helmsman import helpers as hm_helpers
+from helmsman import templating
 from helmsman.api import HelmsManAPI
 from helmsman.api import HMServiceContext
+from helmsman.api import InvalidInstallTemplateContextException
+from helmsman.clients.helm_client import HelmReleaseService
+
+from .client_mocker import ClientMocker
 
 class InstallTemplateUnitTest(TestCase):
 
@@ -52,3 +62,154 @@ class InstallTemplateUnitTest(TestCase):
 
         host_rendered = tpl.render_values(context={'domain': 'example.com'})
         self.assertEquals(host_expected, host_rendered)
+
+    def test_context_is_stored_as_json(self):
+        tpl = self.client.templates.create(
+            'contexttpl', 'dummyrepo', 'dummychart',
+            template='name: {{ context.name }}', context='name: yaml')
+        self.assertEqual(tpl.template_obj.context, {'name': 'yaml'})
+        tpl = self.client.templates.update(
+            tpl, 'dummyrepo', 'dummychart', template=tpl.template,
+            context={'name': 'dict'})
+        self.assertEqual(self.client.templates.get('contexttpl').context,
+                         {'name': 'dict'})
+        self.assertEqual(tpl.render_values({}), 'name: dict')
+
+    def test_context_must_be_a_mapping(self):
+        for context in ('- a\n- b', 'just text', ['a'], 'a: [b'):
+            with self.assertRaises(InvalidInstallTemplateContextException):
+                self.client.templates.create(
+                    'badcontexttpl', 'dummyrepo', 'dummychart',
+                    template='name: x', context=context)
+
+    def test_render_values_compiles_once(self):
+        templating.get_template_cache().clear()
+        tpl = self.client.templates.create(
+            'cachedtpl', 'dummyrepo', 'dummychart',
+            template='name: {{ context.name }}')
+        with patch('helmsman.templating.compile_template',
+                   wraps=templating.compile_template) as compile:
+            self.assertEqual(tpl.render_values({'name': 'a'}), 'name: a')
+            self.assertEqual(tpl.render_values({'name': 'b'}), 'name: b')
+            self.assertEqual(compile.call_count, 1)
+            # an updated template is compiled again
+            tpl = self.client.templates.update(
+                tpl, 'dummyrepo', 'dummychart',
+                template='id: {{ context.name }}')
+            self.assertEqual(tpl.render_values({'name': 'c'}), 'id: c')
+            self.assertEqual(compile.call_count, 2)
+
+    @override_settings(CM_GLOBAL_CONTEXT={'domain': 'globaldomain.com'})
+    def test_render_values_many(self):
+        self.client.templates.create(
+            'batchtpl', 'dummyrepo', 'dummychart',
+            template='host: {{ context.global.domain }}/{{ context.name }}\n'
+                     '{{ context.missing.key.upper() }}',
+            context={'missing': {'key': 'default'}})
+        results = self.client.templates.render_values_many(
+            'batchtpl', [{'name': 'first'}, {'name': 'second', 'missing': None},
+                         None])
+        self.assertEqual(results[0], 'host: globaldomain.com/first\nDEFAULT')
+        self.assertIsInstance(results[1], Exception)
+        self.assertEqual(results[2], 'host: globaldomain.com/\nDEFAULT')
+
+    def test_template_cache_evicts_least_recently_used(self):
+        cache = templating.TemplateCache(maxsize=2)
+        first = cache.get("a", version="v1")
+        second = cache.get("b")
+        self.assertIs(cache.get("a", version="v1"), first)
+        cache.get("c")
+        self.assertEqual(len(cache), 2)
+        self.assertIs(cache.get("a", version="v1"), first)
+        self.assertIsNot(cache.get("b"), second)
+
+
+class ChartServiceUnitTest(TestCase):
+
+    def setUp(self):
+        self.mock_client = ClientMocker(self)
+        admin = User.objects.get_or_create(
+            username='admin', is_superuser=True)[0]
+        self.client = HelmsManAPI(HMServiceContext(user=admin))
+
+    def test_list_without_values_is_lazy(self):
+        with patch.object(HelmReleaseService, 'get_values', autospec=True,
+                          return_value={'foo': 'bar'}) as get_values:
+            charts = self.client.charts.list(with_values=False)
+            self.assertEqual([c.id for c in charts], ['turbulent-markhor'])
+            get_values.assert_not_called()
+            self.assertEqual(charts[0].values, {'foo': 'bar'})
+            self.assertEqual(charts[0].values, {'foo': 'bar'})
+            self.assertEqual(get_values.call_count, 1)
+
+    def test_get_only_loads_values_on_access(self):
+        with patch.object(HelmReleaseService, 'get_values',
+                          autospec=True, return_value={}) as get_values:
+            chart = self.client.charts.get('turbulent-markhor')
+            self.assertEqual(chart.name, 'cloudlaunch')
+            get_values.assert_not_called()
+
+    def test_get_is_targeted(self):
+        with patch('clusterman.clients.helpers.run_command',
+                   wraps=self.mock_client.mock_run_command) as run_command:
+            chart = self.client.charts.get('turbulent-markhor',
+                                           namespace='default')
+            helm_calls = [c[0][0] for c in run_command.call_args_list
+                          if c[0][0][0] == 'helm']
+        self.assertEqual(chart.id, 'turbulent-markhor')
+        self.assertEqual(len(helm_calls), 1)
+        self.assertIn('--filter', helm_calls[0])
+        self.assertIsNone(self.client.charts.get('turbulent'))
+
+    def test_list_loads_install_templates_once(self):
+        self.client.templates.create('cloudlaunch', 'cloudve', 'cloudlaunch')
+        with self.assertNumQueries(1):
+            templates = self.client.templates.find_by_chart()
+        with patch('helmsman.api.HMInstallTemplateService.find') as find:
+            charts = self.client.charts.list(with_values=False)
+            find.assert_not_called()
+        self.assertEqual(charts[0].install_template.name,
+                         templates['cloudlaunch'].name)
+
+    def test_values_layers_are_merged_and_sent_on_stdin(self):
+        with patch('clusterman.clients.helpers.run_command',
+                   wraps=self.mock_client.mock_run_command) as run_command:
+            HelmReleaseService(None).create(
+                'cloudve/galaxy', 'default', release_name='merged',
+                values=[{'a': {'b': 1, 'c': [1]}}, None, {'a': {'c': [2]}}])
+            cmd = run_command.call_args[0][0]
+            stdin = run_command.call_args[1]['input']
+        self.assertEqual(cmd[-2:], ['-f', '-'])
+        self.assertEqual(yaml.safe_load(stdin), {'a': {'b': 1, 'c': [2]}})
+        chart = self.client.charts.get('merged')
+        self.assertEqual(chart.values, {'a': {'b': 1, 'c': [2]}})
+
+    def test_update_skips_unchanged_release(self):
+        chart = self.client.charts.get('turbulent-markhor')
+        with patch('clusterman.clients.helpers.run_command',
+                   wraps=self.mock_client.mock_run_command) as run_command:
+            def upgrades():
+                return [c for c in run_command.call_args_list
+                        if c[0][0][:2] == ['helm', 'upgrade']]
+            updated = self.client.charts.update(chart, {'foo': 'bar'},
+                                                version='0.2.0')
+            self.assertEqual(upgrades(), [])
+            self.assertEqual(updated.revision, chart.revision)
+            self.client.charts.update(chart, {'foo': 'bar'}, version='0.2.0',
+                                      force=True)
+            self.assertEqual(len(upgrades()), 1)
+            chart = self.client.charts.get('turbulent-markhor')
+            self.client.charts.update(chart, {'foo': 'baz'}, version='0.2.0')
+            self.assertEqual(len(upgrades()), 2)
+
+
+class MergeValuesUnitTest(TestCase):
+
+    def test_merge_values(self):
+        self.assertEqual(
+            hm_helpers.merge_values(
+                {'a': {'b': 1, 'c': 2}, 'l': [1, 2]},
+                None,
+                {'a': {'c': None, 'd': 3}, 'l': [3]}),
+            {'a': {'b': 1, 'c': None, 'd': 3}, 'l': [3]})
+        self.assertEqual(hm_helpers.merge_values(), {})
@@ -9,6 +9,7 @@ from .client_mocker import ClientMocker
 from ..clients.helm_client import HelmClient
 
 from helmsman import models as hm_models
+from helmsman import templating
 from helmsman.api import NamespaceNotFoundException
 from helmsman.api import HelmsManAPI, HMServiceContext
 
@@ -71,6 +72,15 @@ class CommandsTestCase(TestCase):
         template = hm_models.HMInstallTemplate.objects.get(name='anotherdummy')
         self.assertEqual(template.chart_version, "4.0.0")
 
+    def test_warm_template_cache(self):
+        call_command('helmsman_load_config', self.INITIAL_HELMSMAN_DATA)
+        templating.get_template_cache().clear()
+        call_command('helmsman_warm_template_cache')
+        # templates with the same text share a compiled template
+        sources = {text or '' for text in hm_models.HMInstallTemplate.objects
+                   .values_list('template', flat=True)}
+        self.assertEqual(len(templating.get_template_cache()), len(sources))
+
     def test_update_chart(self):
         call_command('helmsman_load_config', self.INITIAL_HELMSMAN_DATA)
         call_command('helmsman_load_config', self.INITIAL_HELMSMAN_DATA_UPDATE)
@@ -185,7 +185,8 @@ class PMProjectChartService(PMService):
                 if self.has_permissions('projman.view_chart', self._to_proj_chart(chart))]
 
     def get(self, chart_id):
-        chart = self._get_helmsman_api().charts.get(chart_id)
+        chart = self._get_helmsman_api().charts.get(
+            chart_id, namespace=self.project.namespace)
         if chart:
             proj_chart = self._to_proj_chart(chart)
             self.check_permissions('projman.view_chart', proj_chart)
@@ -221,16 +222,17 @@ class PMProjectChartService(PMService):
             template.install(self.project.namespace, release_name,
                              values, context=context))
 
-    def update(self, chart, values, context=None, reset_values=None):
+    def update(self, chart, values, context=None, reset_values=None,
+               force=False):
         self.check_permissions('projman.change_chart', chart)
         context = self._add_projman_default_context(context)
         if chart.install_template:
             updated_chart = chart.install_template.upgrade(
                 chart, values=values, context=context,
-                reset_values=reset_values)
+                reset_values=reset_values, force=force)
         else:
             updated_chart = self._get_helmsman_api().charts.update(
-                chart, values, reset_values=reset_values)
+                chart, values, reset_values=reset_values, force=force)
         return self._to_proj_chart(updated_chart)
 
     def rollback(self, chart, revision=None):
@@ -20,6 +20,8 @@ class Command(BaseCommand):
         parser.add_argument('context_file', help='Context to apply to the chart')
         parser.add_argument('--upgrade', dest='upgrade_chart', action='store_true')
         parser.add_argument('--reset_values', dest='reset_values', action='store_true')
+        parser.add_argument('--force_upgrade', dest='force_upgrade',
+                            action='store_true')
 
     def handle(self, *args, **options):
         values_file = options.get("values_file")
@@ -40,12 +42,14 @@ class Command(BaseCommand):
                                          values,
                                          context=context,
                                          upgrade_chart=options['upgrade_chart'],
-                                         reset_values=options['reset_values'])
+                                         reset_values=options['reset_values'],
+                                         force_upgrade=options['force_upgrade'])
 
     @staticmethod
     def install_template_in_project(project_name, template_name,
                                     release_name=None, values=None, context=None,
-                                    upgrade_chart=False, reset_values=False):
+                                    upgrade_chart=False, reset_values=False,
+                                    force_upgrade=False):
         try:
             print("Installing template {}"
                   " into project: {}".format(template_name, project_name))
@@ -62,7 +66,8 @@ class Command(BaseCommand):
                     existing = proj.charts.find(template_name)
                 if existing and upgrade_chart:
                     ch = proj.charts.update(existing, values, context=context,
-                                            reset_values=reset_values)
+                                            reset_values=reset_values,
+                                            force=force_upgrade)
                     print(f"Successfully updated template '{template_name}' "
                           f"with release named '{release_name}' into project "
                           f"'{project_name}'")
@@ -36,6 +36,8 @@ class Command(BaseCommand):
                             extra_args += ['--upgrade']
                         if chart.get("reset_values"):
                             extra_args += ['--reset_values']
+                        if chart.get("force_upgrade"):
+                            extra_args += ['--force_upgrade']
                         with helpers.TempValuesFile(values) as values_file:
                             with helpers.TempValuesFile(context) as context_file:
                                 call_command("install_template_in_project",